@@ -1,25 +1,50 @@
 import json
-import hashlib
 import os
+import sys
+
+# the shared helpers (hashing, background writer, metrics) live in the Module2 directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Module2"))
+from hashing import Hasher
+from metrics import listdir, open_file, timed
+from writer import BlockWriter
 
 
 class Blockchain:
-    def __init__(self, blockchain_dir="blocks"):
+    def __init__(self, blockchain_dir="blocks", durability=None, hash_algorithm="sha256"):
         self.blockchain_dir = blockchain_dir
+        # one algorithm for the file hashes and the block hashes (sha256 keeps the old links valid)
+        self.hasher = Hasher(hash_algorithm)
         if not os.path.exists(self.blockchain_dir):
             os.mkdir(self.blockchain_dir)
+        # with a durability level ("none", "batch", "block") blocks are written by a background thread
+        self.writer = BlockWriter(durability) if durability else None
+
+    def flush(self):
+        """Waiting for the blocks queued in the background writer"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        """Writing out the queued blocks and stopping the background writer"""
+        if self.writer is not None:
+            self.writer.close()
 
+    @timed("get_hash")
     def get_hash(self, filename):
         """Calculating the hash for the block"""
-        with open(filename, 'rb') as f:
-            content = f.read()
-        return hashlib.sha256(content).hexdigest()
+        if self.writer is not None:
+            self.writer.wait(filename)
+        return self.hasher.hash_file(filename)
 
+    @timed("write_block")
     def write_block(self, block_data, filename):
         """Writing the block into the JSON-file"""
-        with open(filename, 'w') as file:
+        if self.writer is not None:
+            return self.writer.write_json(block_data, filename, indent=4)
+        with open_file(filename, 'w') as file:
             json.dump(block_data, file, indent=4)
 
+    @timed("create_genesis_block")
     def create_genesis_block(self):
         """Creating the genesis-block"""
         genesis_data = {
@@ -31,15 +56,17 @@ class Blockchain:
             "price": "100$"
         }
 
-        genesis_data["block_hash"] = hashlib.md5(json.dumps(genesis_data).encode()).hexdigest()
+        genesis_data["block_hash"] = self.hasher.hash_bytes(json.dumps(genesis_data).encode())
         self.write_block(genesis_data, os.path.join(self.blockchain_dir, "block_0.json"))
         print("Genesis block has been created")
 
+    @timed("create_new_block")
     def create_new_block(self, date, buyer, seller, price):
         """Creating the new block with the specified data"""
 
-        # Determining the number of the new block
-        previous_block_index = len(os.listdir(self.blockchain_dir)) - 1
+        # Determining the number of the new block (all queued blocks must be in the directory)
+        self.flush()
+        previous_block_index = len(listdir(self.blockchain_dir)) - 1
         previous_block_filename = os.path.join(self.blockchain_dir, f"block_{previous_block_index}.json")
 
         # Getting the hash the previous block
@@ -56,31 +83,34 @@ class Blockchain:
         }
 
         # Calculating the hash of the current block and saving it
-        new_block_data["block_hash"] = hashlib.md5(json.dumps(new_block_data).encode()).hexdigest()
+        new_block_data["block_hash"] = self.hasher.hash_bytes(json.dumps(new_block_data).encode())
         new_block_filename = os.path.join(self.blockchain_dir, f"block_{new_block_data['index']}.json")
         self.write_block(new_block_data, new_block_filename)
 
         print(f"Block {new_block_data['index']} has been created")
 
+    @timed("view_block")
     def view_block(self, block_index):
         """Viewing the contents' block by number"""
+        self.flush()
         filename = os.path.join(self.blockchain_dir, f"block_{block_index}.json")
         if not os.path.exists(filename):
             print(f"Block with number {block_index} does not exist")
             return
 
-        with open(filename, 'r') as file:
+        with open_file(filename, 'r') as file:
             block_data = json.load(file)
             print(json.dumps(block_data, indent=4))
 
 
-blockchain = Blockchain()
-blockchain.create_genesis_block()  # Generating genesis-block
+if __name__ == "__main__":
+    blockchain = Blockchain()
+    blockchain.create_genesis_block()  # Generating genesis-block
 
-# Generating a new blocks
-blockchain.create_new_block("2024-02-01", "Alice", "Library", 100)
-blockchain.create_new_block("2024-03-01", "Bob", "Library", 150)
+    # Generating a new blocks
+    blockchain.create_new_block("2024-02-01", "Alice", "Library", 100)
+    blockchain.create_new_block("2024-03-01", "Bob", "Library", 150)
 
-# Viewing the contents' block by number
-blockchain.view_block(1)
-blockchain.view_block(2)
+    # Viewing the contents' block by number
+    blockchain.view_block(1)
+    blockchain.view_block(2)
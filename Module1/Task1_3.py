@@ -1,25 +1,196 @@
+import contextlib
 import json
-import hashlib
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# the shared helpers (hashing, indexes, cache, background writer, metrics, sequencer) live in the Module2 directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Module2"))
+from block_cache import BlockCache
+from hashing import Hasher
+from indexes import InvertedIndex, TimeIndex
+from metrics import open_file, timed
+from sequencer import APPEND_RETRIES, ChainConflictError, FileLock, chain_height, probe_height, publish
+from writer import BlockWriter, fsync_dir, fsync_path
+
+INDEXED_FIELDS = ("buyer", "seller", "price", "date")
+
+
+def _verify_range(blockchain_dir, start, end, hash_algorithm):
+    """Re-hashing the blocks start..end-1 and checking the links between them (runs in a worker process)"""
+    hasher = Hasher(hash_algorithm)
+    started = time.perf_counter()
+    hashes, previous_hashes = [], []
+    bytes_read = 0
+    for block_index in range(start, end):
+        try:
+            with open_file(os.path.join(blockchain_dir, f"block_{block_index}.json"), 'rb') as file:
+                content = file.read()
+            bytes_read += len(content)
+            hashes.append(hasher.hash_bytes(content))
+            previous_hashes.append(json.loads(content)["previous_hash"])
+        except (OSError, ValueError, KeyError):
+            # a missing or damaged block breaks both of its links
+            hashes.append(None)
+            previous_hashes.append(None)
+
+    broken = [start + i for i in range(len(hashes) - 1)
+              if hashes[i] is None or previous_hashes[i + 1] != hashes[i]]
+    return {
+        "pid": os.getpid(),
+        "range": [start, end],
+        "broken": broken,
+        "first_previous_hash": previous_hashes[0],
+        "last_hash": hashes[-1],
+        "bytes": bytes_read,
+        "seconds": time.perf_counter() - started
+    }
 
 
 class Blockchain:
-    def __init__(self, blockchain_dir="blocks"):
+    def __init__(self, blockchain_dir="blocks", durability=None, hash_algorithm="md5", cache_bytes=64 * 1024 * 1024,
+                 shared=False):
         self.blockchain_dir = blockchain_dir
+        self.hasher = Hasher(hash_algorithm)
         if not os.path.exists(self.blockchain_dir):
             os.mkdir(self.blockchain_dir)
+        # shared=True: several processes add blocks, the numbering is done under a lock kept next to the
+        # blocks directory and every block file is created exclusively before the lock is released
+        self.shared = shared
+        self._lock = FileLock(f"{blockchain_dir}.lock") if shared else None
+        # with a durability level ("none", "batch", "block") blocks are written by a background thread,
+        # a shared chain writes them itself and syncs each one
+        self.durability = durability
+        self.writer = BlockWriter(durability) if durability and not shared else None
+        self._height = None
+        # number and file hash of the last block written by this process, the next block links to it
+        # without waiting for the writer
+        self._tip = None
+        # parsed blocks and hashes of their files, most queries are about the last blocks
+        self.cache = BlockCache(cache_bytes)
+        # (field, value) -> numbers of the blocks, kept next to the blocks directory
+        self.index = InvertedIndex(f"{blockchain_dir}_index.log")
+        self.time_index = TimeIndex(f"{blockchain_dir}_time_index.bin")
+        self._sync_index()
 
+    def flush(self):
+        """Waiting for the blocks queued in the background writer"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        """Writing out the queued blocks, closing the indexes and the lock"""
+        if self.writer is not None:
+            self.writer.close()
+        self.index.close()
+        self.time_index.close()
+        if self._lock is not None:
+            self._lock.close()
+
+    @timed("get_hash")
     def get_hash(self, filename):
         """Calculating the hash for the block"""
-        with open(filename, 'rb') as file:
+        if self.writer is not None:
+            self.writer.wait(filename)
+        return self._cached_file(filename)[1]
+
+    def _read_file(self, filename):
+        """Reading the block file: the parsed block and the hash of the file"""
+        with open_file(filename, 'rb') as file:
             content = file.read()
-        return hashlib.md5(content).hexdigest()
+        return json.loads(content), self.hasher.hash_bytes(content)
+
+    def _cached_file(self, filename):
+        """Getting the parsed block and the hash of its file, read again when the mtime or size of the file changed"""
+        stat = os.stat(filename)
+        return self.cache.get(filename, lambda: (self._read_file(filename), stat.st_size),
+                              (stat.st_mtime_ns, stat.st_size))
+
+    @timed("write_block")
+    def write_block(self, block_data, filename, exclusive=False):
+        """Writing the block into the JSON-file (exclusive: only if there is no such file yet)"""
+        self.cache.invalidate(filename)
+        future = None
+        if self.writer is not None:
+            future = self.writer.write_json(block_data, filename, indent=4, exclusive=exclusive)
+            if exclusive:
+                # FileExistsError comes from the writer thread, nothing is indexed before it's known
+                future.result()
+        elif exclusive:
+            publish(filename, json.dumps(block_data, indent=4))
+        else:
+            with open_file(filename, 'w') as file:
+                json.dump(block_data, file, indent=4)
+        if future is None and self.shared and self.durability in ("batch", "block"):
+            fsync_path(filename)
+            fsync_dir(os.path.dirname(filename) or ".")
+        self._index_block(block_data)
+        # a queued block isn't on the disk yet, so the height and the tip are taken from it
+        if self._height is not None:
+            self._height = max(self._height, block_data["index"] + 1)
+        self._tip = (block_data["index"], self.hasher.hash_bytes(json.dumps(block_data, indent=4).encode()))
+        return future
+
+    @contextlib.contextmanager
+    def _appending(self):
+        """Taking the lock of a shared chain for one append, other processes wait for it"""
+        if self._lock is None:
+            yield
+            return
+        with self._lock:
+            self.flush()
+            yield
+
+    def _block_count(self):
+        """Counting block_N.json files, including the ones written by other processes"""
+        if self._height is None:
+            self._height = chain_height(self.blockchain_dir)
+        self._height = probe_height(self.blockchain_dir, self._height)
+        return self._height
+
+    def _catch_up(self):
+        """Reading the index entries and blocks added by other processes"""
+        height = self._height
+        if self._block_count() != height:
+            self.index.refresh()
+            self.time_index.refresh()
+            self._sync_index()
+
+    def _read_block(self, block_index):
+        self.flush()
+        return self._cached_file(os.path.join(self.blockchain_dir, f"block_{block_index}.json"))[0]
+
+    def _index_block(self, block_data):
+        """Adding the fields of the written block to the search indexes"""
+        indexes = (self.index, self.time_index)
+        if all(block_data["index"] == index.height for index in indexes):
+            self._add_to_indexes(block_data["index"], block_data)
+            return
+        # the block was rewritten or written out of order, so the indexes are rebuilt from the files
+        if any(block_data["index"] < index.height for index in indexes):
+            for index in indexes:
+                index.reset()
+        self._sync_index()
 
-    def write_block(self, block_data, filename):
-        """Writing the block into the JSON-file"""
-        with open(filename, 'w') as file:
-            json.dump(block_data, file, indent=4)
+    def _add_to_indexes(self, block_index, block_data):
+        if block_index >= self.index.height:
+            self.index.add(block_index, [(field, block_data.get(field)) for field in INDEXED_FIELDS])
+        if block_index >= self.time_index.height:
+            self.time_index.add(block_index, block_data["date"])
 
+    def _sync_index(self):
+        """Indexing the blocks which are not in the indexes yet"""
+        self.flush()
+        block_count = self._block_count()
+        indexes = (self.index, self.time_index)
+        for index in indexes:
+            if index.height > block_count:
+                index.reset()
+        for block_index in range(min(index.height for index in indexes), block_count):
+            self._add_to_indexes(block_index, self._read_block(block_index))
+
+    @timed("create_genesis_block")
     def create_genesis_block(self):
         """Creating the genesis-block"""
         genesis_data = {
@@ -31,83 +202,173 @@ class Blockchain:
             "price": "100$"
         }
 
-        genesis_data["block_hash"] = hashlib.md5(json.dumps(genesis_data).encode()).hexdigest()
-        self.write_block(genesis_data, os.path.join(self.blockchain_dir, "block_0.json"))
+        genesis_data["block_hash"] = self.hasher.hash_bytes(json.dumps(genesis_data).encode())
+        with self._appending():
+            # the genesis block is the same every time, an existing one is kept
+            if self._block_count():
+                print("Genesis block already exists")
+                return
+            self.write_block(genesis_data, os.path.join(self.blockchain_dir, "block_0.json"), exclusive=self.shared)
         print("Genesis block has been created")
 
+    @timed("create_new_block")
     def create_new_block(self, date, buyer, seller, price):
-        previous_block_index = len(os.listdir(self.blockchain_dir)) - 1
-        previous_block_filename = os.path.join(self.blockchain_dir, f"block_{previous_block_index}.json")
-        previous_hash = self.get_hash(previous_block_filename)
-
-        new_block_data = {
-            "index": previous_block_index + 1,
-            "date": date,
-            "previous_hash": previous_hash,
-            "buyer": buyer,
-            "seller": seller,
-            "price": price
-        }
+        # in a shared chain the lock orders the appends of all processes, the exclusive write catches the ones
+        # without it; a chain of one process writes through the background writer without waiting for it
+        with self._appending():
+            for _ in range(APPEND_RETRIES):
+                self._catch_up()
+                previous_block_index = self._block_count() - 1
+                if self._tip is not None and self._tip[0] == previous_block_index:
+                    previous_hash = self._tip[1]
+                else:
+                    previous_hash = self.get_hash(os.path.join(self.blockchain_dir,
+                                                               f"block_{previous_block_index}.json"))
 
-        new_block_data["block_hash"] = hashlib.md5(json.dumps(new_block_data).encode()).hexdigest()
-        new_block_filename = os.path.join(self.blockchain_dir, f"block_{new_block_data['index']}.json")
-        self.write_block(new_block_data, new_block_filename)
+                new_block_data = {
+                    "index": previous_block_index + 1,
+                    "date": date,
+                    "previous_hash": previous_hash,
+                    "buyer": buyer,
+                    "seller": seller,
+                    "price": price
+                }
+
+                new_block_data["block_hash"] = self.hasher.hash_bytes(json.dumps(new_block_data).encode())
+                new_block_filename = os.path.join(self.blockchain_dir, f"block_{new_block_data['index']}.json")
+                try:
+                    self.write_block(new_block_data, new_block_filename, exclusive=self.shared)
+                    break
+                except FileExistsError:
+                    continue
+            else:
+                raise ChainConflictError(f"The block was not appended after {APPEND_RETRIES} attempts")
 
         print(f"New block {new_block_data['index']} has been created")
 
+    @timed("view_block")
     def view_block(self, block_index):
         """Viewing the contents' block by number"""
+        self.flush()
         filename = os.path.join(self.blockchain_dir, f"block_{block_index}.json")
-        if not os.path.exists(filename):
+        try:
+            block_data = self._cached_file(filename)[0]
+        except FileNotFoundError:
             print(f"Block with number {block_index} does not exist")
             return
 
-        with open(filename, 'r') as file:
-            block_data = json.load(file)
-            print(json.dumps(block_data, indent=4))
+        print(json.dumps(block_data, indent=4))
 
+    def _find_blocks(self, field, value):
+        """Getting the numbers of blocks with the value in the field"""
+        if field in INDEXED_FIELDS:
+            return self.index.find((field, value))
+        # fields without an index still need a full scan
+        self.flush()
+        return [block_index for block_index in range(self._block_count())
+                if self._read_block(block_index).get(field) == value]
+
+    @timed("search_block")
     def search_block(self, field, value):
         """Searching for blocks containing the specified data in a specific field"""
-        for filename in os.listdir(self.blockchain_dir):
-            with open(os.path.join(self.blockchain_dir, filename), 'r') as file:
-                block_data = json.load(file)
-                if block_data.get(field) == value:
-                    print(f"Found match in {block_data['index']} block")
-                    print(json.dumps(block_data, indent=4))
-                    return
+        block_indexes = self._find_blocks(field, value)
+        if block_indexes:
+            block_data = self._read_block(block_indexes[0])
+            print(f"Found match in {block_data['index']} block")
+            print(json.dumps(block_data, indent=4))
+            return
         print(f"Value '{value}' by field '{field}' not found")
 
+    @timed("search_blocks")
+    def search_blocks(self, field, value):
+        """Getting all blocks containing the specified data in a specific field"""
+        return [self._read_block(block_index) for block_index in self._find_blocks(field, value)]
+
+    @timed("search_by_date")
+    def search_by_date(self, start, end):
+        """Getting the blocks with start <= date <= end, one block at a time"""
+        for block_index in self.time_index.range(start, end):
+            yield self._read_block(block_index)
+
+    @timed("verify_block")
     def verify_block(self, block_index):
         """Checking the hash of an arbitrary block"""
+        self.flush()
         current_block_filename = os.path.join(self.blockchain_dir, f"block_{block_index}.json")
         next_block_filename = os.path.join(self.blockchain_dir, f"block_{block_index + 1}.json")
 
-        # checking for the next block
-        if not os.path.exists(next_block_filename):
+        # checking for the next block, both files are read from the disk and not from the cache
+        try:
+            next_block_data = self._read_file(next_block_filename)[0]
+        except FileNotFoundError:
             print(f"Block {block_index + 1} not found. It's impossible to verify integrity of the block {block_index}")
             return
 
         # getting the hash current block
-        calculated_hash = self.get_hash(current_block_filename)
+        calculated_hash = self._read_file(current_block_filename)[1]
 
         # comparing with the hash, stored in the next block
-        with open(next_block_filename, 'r') as file:
-            next_block_data = json.load(file)
-            if next_block_data["previous_hash"] == calculated_hash:
-                print(f"The hash of the block {block_index} has been verified")
-            else:
-                print(f"The hash of the block {block_index} doesn't match with the hash of the previous block {block_index + 1}")
+        if next_block_data["previous_hash"] == calculated_hash:
+            print(f"The hash of the block {block_index} has been verified")
+        else:
+            print(f"The hash of the block {block_index} doesn't match with the hash of the previous block {block_index + 1}")
+
+    @timed("verify_chain")
+    def verify_chain(self, workers=None, chunk_size=None):
+        """Checking the hashes of all blocks on a process pool"""
+        self.flush()
+        block_count = self._block_count()
+        workers = workers or os.cpu_count() or 1
+        if chunk_size is None:
+            # several chunks per worker, so a slow chunk doesn't leave the other workers idle
+            chunk_size = max(1, -(-block_count // (workers * 4)))
+        ranges = [(start, min(start + chunk_size, block_count)) for start in range(0, block_count, chunk_size)]
+
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_verify_range, [self.blockchain_dir] * len(ranges), *zip(*ranges),
+                                        [self.hasher.algorithm] * len(ranges))) if ranges else []
+        seconds = time.perf_counter() - started
+
+        # the links between neighbouring ranges are checked here
+        broken = []
+        for result, next_result in zip(results, results[1:] + [None]):
+            broken.extend(result["broken"])
+            if next_result is not None and (result["last_hash"] is None
+                                            or next_result["first_previous_hash"] != result["last_hash"]):
+                broken.append(result["range"][1] - 1)
+
+        per_worker = {}
+        for result in results:
+            stats = per_worker.setdefault(result["pid"], {"pid": result["pid"], "blocks": 0, "bytes": 0, "seconds": 0.0})
+            stats["blocks"] += result["range"][1] - result["range"][0]
+            stats["bytes"] += result["bytes"]
+            stats["seconds"] += result["seconds"]
+        for stats in per_worker.values():
+            stats["blocks_per_sec"] = stats["blocks"] / stats["seconds"] if stats["seconds"] else 0.0
+
+        report = {
+            "blocks": block_count,
+            "broken": broken,
+            "seconds": seconds,
+            "blocks_per_sec": block_count / seconds if seconds else 0.0,
+            "workers": list(per_worker.values())
+        }
+        print(f"Verified {block_count} blocks in {seconds:.2f} s, broken blocks: {broken or 'none'}")
+        return report
 
 
-blockchain = Blockchain()
+if __name__ == "__main__":
+    blockchain = Blockchain()
 
-blockchain.create_genesis_block()
-blockchain.create_new_block("2024-11-13", "Alice", "Library", 100)
-blockchain.create_new_block("2024-11-14", "Bob", "Library", 150)
+    blockchain.create_genesis_block()
+    blockchain.create_new_block("2024-11-13", "Alice", "Library", 100)
+    blockchain.create_new_block("2024-11-14", "Bob", "Library", 150)
 
-blockchain.search_block("buyer", "Bob")
+    blockchain.search_block("buyer", "Bob")
 
-blockchain.verify_block(1)
+    blockchain.verify_block(1)
+    blockchain.verify_chain()
 
 
 
@@ -1,90 +1,496 @@
 import  json
+import contextlib
 import os
-import hashlib
+import threading
 from datetime import datetime
 
+from block import Block
+from block_cache import BlockCache
+from chain_stream import ChainLinkError, export_chain, import_chain
+from hashing import Hasher
+from indexes import InvertedIndex, TimeIndex
+from merkle import merkle_proof, merkle_root
+from metrics import open_file, timed
+from sequencer import APPEND_RETRIES, ChainConflictError, FileLock
+from snapshot import HashList, load_snapshot, save_snapshot
+from storage import FileStorage
+from writer import BlockWriter
+
 
 class Blockchain:
-    def __init__(self, blocks_dir="blocks"):
+    def __init__(self, blocks_dir="blocks", storage=None, durability=None, binary=False, hash_algorithm="md5",
+                 signer=None, snapshot_interval=None, shared=False, cache_bytes=64 * 1024 * 1024):
         self.blocks_dir = blocks_dir
-        if not os.path.exists(self.blocks_dir):
-            os.mkdir(self.blocks_dir)
+        self.hasher = Hasher(hash_algorithm)
+        # by default blocks are kept in the legacy block_N.json layout
+        self.storage = storage if storage is not None else FileStorage(blocks_dir)
+        # with a snapshot only the blocks written after it are read on start
+        self._rewritten = False
+        snapshot = self._load_snapshot()
+        # (buyer, seller) -> heights of the blocks with such a transaction
+        self.transaction_index = InvertedIndex(os.path.join(self.storage.blocks_dir, "tx_index.log"),
+                                               snapshot and snapshot["transaction_index"])
+        # date -> heights, for range queries
+        self.time_index = TimeIndex(os.path.join(self.storage.blocks_dir, "time_index.bin"),
+                                    snapshot and snapshot["time_index"])
+        if self._rewritten:
+            # the index logs describe the blocks as they were before the rewrite
+            self.transaction_index.reset()
+            self.time_index.reset()
+        self._sync_index()
+        # block_hash of every height, built on first use when there is no snapshot
+        self._hashes = None
+        if snapshot:
+            self._hashes = HashList(snapshot["hashes"], snapshot["digest_size"])
+            self._sync_hashes()
+        # a snapshot is saved after every snapshot_interval blocks
+        self.snapshot_interval = snapshot_interval
+        # shared=True: several processes append to the chain, each append takes a lock on the directory
+        self._lock = None
+        if shared:
+            if not isinstance(self.storage, FileStorage):
+                raise ValueError("only the block_N.json layout can be shared between processes")
+            self.storage.shared = True
+            self._lock = FileLock(os.path.join(self.storage.blocks_dir, "append.lock"))
+        # with a durability level ("none", "batch", "block") blocks are written by a background thread,
+        # a shared chain writes them before the lock is released and syncs each one
+        self.durability = durability
+        self.writer = BlockWriter(durability, sync=self.storage.sync) if durability and not shared else None
+        # blocks submitted to the writer and not stored yet, so lookups see them without a flush:
+        # height -> block and (buyer, seller) -> heights
+        self._queued = {}
+        self._queued_keys = {}
+        self._queued_lock = threading.Lock()
+        self._last_block = None
+        # recently read blocks, most queries are about the last ones
+        self.cache = BlockCache(cache_bytes)
+        # binary=True builds Block objects, hashed and stored with one canonical encoding
+        self.binary = binary
+        # an object with sign_block(block), e.g. Module3/Part1/block_signing.BlockSigner
+        self.signer = signer
 
     def generate_genesis_block(self):
-        genesis_block = {
-            "index": 0,
-            "date": str(datetime.now()),
-            "previous_hash": "0",
-            "transactions": [{"buyer": "System", "seller": "None", "amount": "0"}]
-        }
-        genesis_block["block_hash"] = self._calculate_hash(genesis_block)
-        self.write_block(genesis_block, os.path.join(self.blocks_dir, "block_0.json"))
+        with self._appending():
+            # the append-only storage cannot replace an existing genesis block
+            if len(self.storage):
+                return
+            genesis_block = {
+                "index": 0,
+                "date": str(datetime.now()),
+                "previous_hash": "0",
+                "transactions": [{"buyer": "System", "seller": "None", "amount": "0"}]
+            }
+            genesis_block["merkle_root"] = merkle_root(genesis_block["transactions"], self.hasher)
+            self.write_block(self._seal(genesis_block))
+
+
+    def _tip(self):
+        # the last block is kept in memory, the storage may still be writing it
+        if self._last_block is None:
+            self._last_block = self.storage.tip()
+        return self._last_block
+
+
+    @contextlib.contextmanager
+    def _appending(self):
+        # appends to a shared chain go one at a time and start from the blocks of the other processes
+        if self._lock is None:
+            yield
+            return
+        with self._lock:
+            self._catch_up()
+            yield
+
 
+    def _catch_up(self):
+        height = len(self.storage)
+        self.storage.resume(height)
+        if len(self.storage) == height:
+            return
+        self._last_block = None
+        self.transaction_index.refresh()
+        self.time_index.refresh()
+        # blocks of a process that stopped before it indexed them
+        self._sync_index()
+        if self._hashes is not None:
+            self._sync_hashes()
 
+
+    @timed("add_block")
     def add_block(self, transactions):
-        blocks = sorted(os.listdir(self.blocks_dir), key=lambda x: int(x.split('_')[1].split('.')[0]))
-        last_block_path = os.path.join(self.blocks_dir, blocks[-1])
-        with open(last_block_path, "r") as f:
-            last_block = json.load(f)
-            new_block = {
-                "index": len(blocks),
-                "date": str(datetime.now()),
-                "previous_hash": last_block["block_hash"],
-                "transactions": transactions
-            }
+        for _ in range(APPEND_RETRIES):
+            with self._appending():
+                last_block = self._tip()
+                new_block = {
+                    "index": last_block["index"] + 1,
+                    "date": str(datetime.now()),
+                    "previous_hash": last_block["block_hash"],
+                    "transactions": transactions,
+                    "merkle_root": merkle_root(transactions, self.hasher)
+                }
+                try:
+                    return self.write_block(self._seal(new_block))
+                except FileExistsError:
+                    # a process without the lock took this height, the block is built again on the new tip
+                    if self._lock is None:
+                        raise
+        raise ChainConflictError(f"The block was not appended after {APPEND_RETRIES} attempts")
+
+
+    @timed("seal")
+    def _seal(self, block_data):
+        if self.binary:
+            block_data = Block.from_dict(block_data)
+            block_data.block_hash = self.hasher.hash_bytes(self._hash_input(block_data))
+        else:
+            block_data["block_hash"] = self.hasher.hash_bytes(self._hash_input(block_data))
+        if self.signer is not None:
+            self.signer.sign_block(block_data)
+        return block_data
+
+
+    def _compute_hash(self, block_data):
+        # a binary chain kept in FileStorage reads its blocks back as dicts
+        if self.binary and not isinstance(block_data, Block):
+            block_data = Block.from_dict(block_data)
+        return self.hasher.hash_bytes(self._hash_input(block_data))
+
+
+    def _verified_hash(self, block_data):
+        # the hash of a header doesn't cover the transactions, so their Merkle root is recomputed too
+        root = block_data.get("merkle_root")
+        if root is not None and merkle_root(block_data["transactions"], self.hasher) != root:
+            return None
+        return self._compute_hash(block_data)
+
+
+    def _hash_input(self, block_data):
+        if isinstance(block_data, Block):
+            return block_data.hash_input()
+        # the Merkle root commits to the transactions, so only the header has to be hashed
+        skipped = Block.SEAL_FIELDS + ("transactions",) if "merkle_root" in block_data else Block.SEAL_FIELDS
+        fields = {field: value for field, value in block_data.items() if field not in skipped}
+        return json.dumps(fields, sort_keys=True).encode()
+
+
+    @timed("audit_hashes")
+    def audit_hashes(self, workers=None, batch_size=4096):
+        """Re-hash every block in batches (see Hasher.hash_many), returns the heights with a wrong block_hash."""
+        self.flush()
+        corrupted = []
+        for start in range(0, len(self.storage), batch_size):
+            blocks = [self.storage.read(height)
+                      for height in range(start, min(start + batch_size, len(self.storage)))]
+            if self.binary:
+                # blocks read back from FileStorage are dicts, their hash is over the Block encoding
+                blocks = [block if isinstance(block, Block) else Block.from_dict(block) for block in blocks]
+            digests = self.hasher.hash_many([self._hash_input(block) for block in blocks], workers)
+            corrupted.extend(start + i for i, (block, digest) in enumerate(zip(blocks, digests))
+                             if block["block_hash"] != digest)
+        return corrupted
+
+
+    def _read_block(self, height):
+        # a block file rewritten on disk (or by another process) has another version and is read again
+        return self.cache.get(height, lambda: self.storage.read_sized(height), self.storage.version(height))
+
+
+    @timed("transaction_proof")
+    def transaction_proof(self, height, position):
+        self.flush()
+        block = self._read_block(height)
+        return {
+            "transaction": block["transactions"][position],
+            "proof": merkle_proof(block["transactions"], position, self.hasher),
+            "merkle_root": block["merkle_root"]
+        }
+
+
+    @timed("write_block")
+    def write_block(self, block_data, file_path=None):
+        # a file path means export of a single block in the legacy JSON format
+        if file_path is not None:
+            if isinstance(block_data, Block):
+                block_data = block_data.to_dict()
+            with open_file(file_path, "w") as f:
+                json.dump(block_data, f, indent=4)
+        else:
+            self.cache.invalidate(block_data["index"])
+            future = None
+            if self.writer is not None:
+                self._queue_block(block_data)
+                future = self.writer.submit(self._append, block_data)
+                future.add_done_callback(lambda done: self._unqueue_block(block_data))
+            else:
+                self._append(block_data)
+                if self._lock is not None and self.durability in ("batch", "block"):
+                    self.storage.sync()
+            self._last_block = block_data
+            if self.snapshot_interval and (block_data["index"] + 1) % self.snapshot_interval == 0:
+                self.save_snapshot()
+            return future
+
+
+    def _append(self, block_data):
+        # the block is indexed once it is stored, a failed append (or a height taken by another
+        # process in a shared chain) leaves nothing in the indexes
+        self.storage.append(block_data)
+        self._index_block(block_data["index"], block_data)
+        if self._hashes is not None and block_data["index"] == len(self._hashes):
+            self._hashes.append(block_data["block_hash"])
+
+
+    def _queue_block(self, block_data):
+        height = block_data["index"]
+        with self._queued_lock:
+            self._queued[height] = block_data
+            for key in dict.fromkeys((t["buyer"], t["seller"]) for t in block_data["transactions"]):
+                self._queued_keys.setdefault(key, []).append(height)
+
+
+    def _unqueue_block(self, block_data):
+        # a stored block is in the transaction index by now, a failed one is dropped from the lookups
+        height = block_data["index"]
+        with self._queued_lock:
+            del self._queued[height]
+            for key in dict.fromkeys((t["buyer"], t["seller"]) for t in block_data["transactions"]):
+                heights = self._queued_keys[key]
+                heights.remove(height)
+                if not heights:
+                    del self._queued_keys[key]
 
-            new_block["block_hash"] = self._calculate_hash(new_block)
-            self.write_block(new_block, os.path.join(self.blocks_dir, f"block_{len(blocks)}.json"))
 
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
 
-    def write_block(self, block_data, file_path):
-        with open(file_path, "w") as f:
-            json.dump(block_data, f, indent=4)
 
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.transaction_index.close()
+        self.time_index.close()
+        self.storage.close()
+        if self._lock is not None:
+            self._lock.close()
 
+
+    def _index_block(self, height, block_data):
+        if height >= self.transaction_index.height:
+            pairs = [(t["buyer"], t["seller"]) for t in block_data["transactions"]]
+            self.transaction_index.add(height, pairs)
+        if height >= self.time_index.height:
+            self.time_index.add(height, block_data["date"])
+
+
+    def _sync_index(self):
+        indexes = (self.transaction_index, self.time_index)
+        for index in indexes:
+            # the index belongs to another (longer) chain, so it is rebuilt from scratch
+            if index.height > len(self.storage):
+                index.reset()
+        for height in range(min(index.height for index in indexes), len(self.storage)):
+            self._index_block(height, self.storage.read(height))
+
+
+    def _snapshot_path(self):
+        return os.path.join(self.storage.blocks_dir, "snapshot.bin")
+
+
+    def _load_snapshot(self):
+        snapshot = load_snapshot(self._snapshot_path())
+        if snapshot is None or snapshot["hash_algorithm"] != self.hasher.algorithm:
+            return None
+        height = snapshot["height"]
+        if isinstance(self.storage, FileStorage):
+            self.storage.resume(height)
+        # the chain was replaced after the snapshot, it is opened the slow way
+        if len(self.storage) < height:
+            return None
+        # a block at or below the snapshot height was rewritten, the indexes are rebuilt from the blocks
+        if (self.storage.fingerprint(height) != snapshot["fingerprint"]
+                or (height and self.storage.read(height - 1)["block_hash"] != snapshot["tip_hash"])):
+            self._rewritten = True
+            return None
+        return snapshot
+
+
+    def _sync_hashes(self):
+        for height in range(len(self._hashes), len(self.storage)):
+            self._hashes.append(self.storage.read(height)["block_hash"])
+
+
+    def save_snapshot(self):
+        """Save the height, the hash of every block and the index state into one file."""
+        self.flush()
+        if self._hashes is None:
+            self._hashes = HashList()
+            self._sync_hashes()
+        height = len(self.storage)
+        save_snapshot(self._snapshot_path(), {
+            "height": height,
+            "tip_hash": self._hashes[height - 1] if height else "",
+            "fingerprint": self.storage.fingerprint(height),
+            "hash_algorithm": self.hasher.algorithm,
+            "hashes": bytes(self._hashes.data),
+            "digest_size": self._hashes.digest_size,
+            "transaction_index": self.transaction_index.state(),
+            "time_index": self.time_index.state()
+        })
+
+
+    def block_hash(self, height):
+        """block_hash of a height from the in-memory hash list, the block body isn't read."""
+        if self._hashes is None:
+            self.flush()
+            self._hashes = HashList()
+            self._sync_hashes()
+        return self._hashes[height]
+
+
+    @timed("export_blocks")
+    def export_blocks(self, export_dir):
+        self.flush()
+        if not os.path.exists(export_dir):
+            os.mkdir(export_dir)
+        for block in self.storage.iter_blocks():
+            self.write_block(block, os.path.join(export_dir, f"block_{block['index']}.json"))
+
+
+    @timed("export_stream")
+    def export_stream(self, out, start=0, end=None, fmt="ndjson", compress=False):
+        self.flush()
+        end = len(self.storage) if end is None else min(end, len(self.storage))
+        return export_chain((self.storage.read(height) for height in range(start, end)), out, fmt, compress)
+
+
+    @timed("import_stream")
+    def import_stream(self, source, fmt="ndjson", compress=False):
+        # the stream must continue this chain, every block is checked and written before the next one is read
+        last_block = self._tip()
+        previous_hash = last_block["block_hash"] if last_block else None
+        count = 0
+        for block in import_chain(source, fmt, compress, previous_hash, compute_hash=self._verified_hash):
+            expected_index = last_block["index"] + 1 if last_block else 0
+            if block["index"] != expected_index:
+                raise ChainLinkError(f"Expected block {expected_index}, got block {block['index']}")
+            self.write_block(block)
+            last_block = block
+            count += 1
+        return count
+
+
+    @timed("calculate_hash")
     def _calculate_hash(self, block_data):
-        return hashlib.md5(json.dumps(block_data, sort_keys=True).encode()).hexdigest()
+        return self.hasher.hash_bytes(json.dumps(block_data, sort_keys=True).encode())
+
+
+    def transaction_heights(self, key):
+        """Heights of the blocks with a (buyer, seller) transaction, blocks still queued in the writer included."""
+        # the queue is looked at first: a block leaves it only after it is indexed
+        with self._queued_lock:
+            queued = list(self._queued_keys.get(tuple(key), ()))
+        heights = self.transaction_index.find(key)
+        return sorted(set(heights).union(queued)) if queued else heights
 
 
+    def _lookup_block(self, height):
+        # a queued block may not be in the storage yet
+        with self._queued_lock:
+            block = self._queued.get(height)
+        return block if block is not None else self._read_block(height)
+
+
+    @timed("search_transaction")
     def search_transaction(self, buyer, seller):
-        for block_file in sorted(os.listdir(self.blocks_dir), key=lambda x: int(x.split('_')[1].split('.')[0])):
-            with open(os.path.join(self.blocks_dir, block_file), "r") as f:
-                block_data = json.load(f)
-                for transaction in block_data["transactions"]:
-                    if transaction["buyer"] == buyer and transaction["seller"] == seller:
-                        return block_data
-        return None
-
-
-    def validate_blockchain(self):
-        blocks = sorted(os.listdir(self.blocks_dir), key=lambda x: int(x.split('_')[1].split('.')[0]))
-        for i in range(1, len(blocks)):
-            with open(os.path.join(self.blocks_dir, blocks[i]), "r") as current_file:
-                current_block = json.load(current_file)
-            with open(os.path.join(self.blocks_dir, blocks[i - 1]), "r") as prev_file:
-                prev_file = json.load(prev_file)
-            if current_block["previous_hash"] != prev_file["block_hash"]:
+        heights = self.transaction_heights((buyer, seller))
+        return self._lookup_block(heights[0]) if heights else None
+
+
+    @timed("search_transactions")
+    def search_transactions(self, buyer, seller):
+        return [self._lookup_block(height) for height in self.transaction_heights((buyer, seller))]
+
+
+    @timed("blocks_between")
+    def blocks_between(self, start, end):
+        # only the blocks in the range are read, one at a time
+        self.flush()
+        heights = self.time_index.range(start, end)
+        for height in heights:
+            yield self._read_block(height)
+
+
+    @timed("validate_blockchain")
+    def validate_blockchain(self, full=False):
+        self.flush()
+        # without full mode only the blocks after the verification watermark are checked
+        start = 0 if full else self._load_watermark()
+        # the blocks are read from the storage, not from their cached copies
+        prev_block = self.storage.read(start - 1) if start else None
+        height = len(self.storage)
+        for current_height in range(start, height):
+            current_block = self.storage.read(current_height)
+            if prev_block is not None and current_block["previous_hash"] != prev_block["block_hash"]:
+                self._drop_watermark()
                 return False
+            prev_block = current_block
+        # nothing was added since the watermark, it still holds and isn't fingerprinted again
+        if prev_block is not None and height != start:
+            self._save_watermark(height, prev_block["block_hash"])
         return True
 
 
-blockchain = Blockchain()
-blockchain.generate_genesis_block()
+    def _watermark_path(self):
+        return os.path.join(self.storage.blocks_dir, "watermark.json")
 
-blockchain.add_block([{"buyer": "Alice", "seller": "Bob", "amount": 100}])
 
-transaction = {"buyer": "Alice", "seller": "Bob", "amount": 100}
-if blockchain.search_transaction(transaction["buyer"], transaction["seller"]):
-    print("Error: the transaction already exists!")
-else:
-    blockchain.add_block([transaction])
+    def _load_watermark(self):
+        try:
+            with open_file(self._watermark_path(), "r") as f:
+                watermark = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return 0
+        height = watermark["height"]
+        # anything at or below the watermark was modified, so the whole chain has to be checked again
+        if (height > len(self.storage)
+                or self.storage.fingerprint(height) != watermark["fingerprint"]
+                or self.storage.read(height - 1)["block_hash"] != watermark["block_hash"]):
+            self._drop_watermark()
+            return 0
+        return height
+
+
+    def _save_watermark(self, height, block_hash):
+        watermark = {
+            "height": height,
+            "block_hash": block_hash,
+            "fingerprint": self.storage.fingerprint(height)
+        }
+        tmp_path = self._watermark_path() + ".tmp"
+        with open_file(tmp_path, "w") as f:
+            json.dump(watermark, f)
+        os.replace(tmp_path, self._watermark_path())
+
 
-if blockchain.validate_blockchain():
-    print("Blockchain is numerical")
-else:
-    print("Blockchain is broken!")
+    def _drop_watermark(self):
+        if os.path.exists(self._watermark_path()):
+            os.remove(self._watermark_path())
 
 
+if __name__ == "__main__":
+    blockchain = Blockchain()
+    blockchain.generate_genesis_block()
 
+    blockchain.add_block([{"buyer": "Alice", "seller": "Bob", "amount": 100}])
 
+    transaction = {"buyer": "Alice", "seller": "Bob", "amount": 100}
+    if blockchain.search_transaction(transaction["buyer"], transaction["seller"]):
+        print("Error: the transaction already exists!")
+    else:
+        blockchain.add_block([transaction])
 
+    if blockchain.validate_blockchain():
+        print("Blockchain is numerical")
+    else:
+        print("Blockchain is broken!")
@@ -1,23 +1,80 @@
 import json
-import hashlib
 import os
+import re
+import time
 from datetime import datetime
 
+from chain_stream import export_chain
+from dag import BlockDag
+from hashing import Hasher
+from indexes import BloomFilter
+from metrics import listdir, open_file, timed
+from mining import meets_difficulty
+from writer import BlockWriter
+
+
+def block_file_key(file_name):
+    # block_2a.json -> (2, "block_2a.json"): forks are ordered by their block number
+    return int(re.match(r"block_(\d+)", file_name).group(1)), file_name
+
 
 class Blockchain:
-    def __init__(self, blockchain_dir):
+    def __init__(self, blockchain_dir, durability=None, hash_algorithm="md5", miner=None):
         self.blockchain_dir = blockchain_dir
+        self.hasher = Hasher(hash_algorithm)
         if not os.path.exists(self.blockchain_dir):
             os.makedirs(self.blockchain_dir)
-
+        self._dag = None
+        # with a durability level ("none", "batch", "block") blocks are written by a background thread
+        self.writer = BlockWriter(durability) if durability else None
+        # with a mining.Miner every block carries a proof of work (nonce and difficulty)
+        self.miner = miner
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    @property
+    def dag(self):
+        # the index of branches is built on first use and then updated by write_block
+        if self._dag is None:
+            self.flush()
+            self._dag = BlockDag()
+            for file_name in sorted(listdir(self.blockchain_dir), key=block_file_key):
+                with open_file(os.path.join(self.blockchain_dir, file_name), "r") as f:
+                    self._dag.add(json.load(f))
+        return self._dag
+
+    @timed("calculate_hash")
     def _calculate_hash(self, block):
         block_string = json.dumps(block, sort_keys=True)
-        return hashlib.md5(block_string.encode()).hexdigest()
+        return self.hasher.hash_bytes(block_string.encode())
 
+    @timed("write_block")
     def write_block(self, block, filename):
-        with open(filename, "w") as f:
-            json.dump(block, f, indent=3)
-
+        future = None
+        if self.writer is not None:
+            future = self.writer.write_json(block, filename, indent=3)
+        else:
+            with open_file(filename, "w") as f:
+                json.dump(block, f, indent=3)
+        if self._dag is not None:
+            reorg = self._dag.add(block)
+            if reorg:
+                print(f"Reorg: {len(reorg['removed'])} blocks removed, {len(reorg['added'])} added.")
+        return future
+
+    def best_tip(self):
+        return self.dag.best_tip
+
+    def common_ancestor(self, first_hash, second_hash):
+        return self.dag.common_ancestor(first_hash, second_hash)
+
+    @timed("create_block")
     def create_block(self, previous_hash, block_number):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         block = {
@@ -26,68 +83,149 @@ class Blockchain:
             "block_hash": "",
             "timestamp": timestamp
         }
-        block["block_hash"] = self._calculate_hash(block)
+        if self.miner is not None:
+            self.miner.mine(block, self.hasher)
+        else:
+            block["block_hash"] = self._calculate_hash(block)
         return block
 
 
 class BlockchainWithMerge(Blockchain):
-    def __init__(self, blockchain_dir):
-        super().__init__(blockchain_dir)
-
-    def validate_and_merge_chain(self, short_chain_dir):
-        short_chain_files = sorted(os.listdir(short_chain_dir), key=lambda x: int(x.split('_')[1].split('.')[0]))
-
-        for file_name in short_chain_files:
-            with open(os.path.join(short_chain_dir, file_name), "r") as f:
-                block = json.load(f)
-
-            if not self.is_block_in_chain(block):
-                self.write_block(block, os.path.join(self.blockchain_dir, file_name))
-                print(f"Block {block['block_number']} added to the main chain.")
-            else:
+    def __init__(self, blockchain_dir, durability=None, hash_algorithm="md5", miner=None):
+        super().__init__(blockchain_dir, durability, hash_algorithm, miner)
+        self._files_by_number = None
+
+    def validate_and_merge_chain(self, short_chain_dir, use_bloom=False):
+        return self._merge(self._read_chain_dir(short_chain_dir), use_bloom)
+
+    def merge_blocks(self, blocks, use_bloom=False):
+        # blocks from a stream, e.g. chain_stream.import_chain over a pipe, nothing is staged on disk
+        return self._merge(((f"block_{block['block_number']}.json", block) for block in blocks), use_bloom)
+
+    @timed("export_stream")
+    def export_stream(self, out, fmt="ndjson", compress=False):
+        self.flush()
+        return export_chain((block for _, block in self._read_chain_dir(self.blockchain_dir)), out, fmt, compress)
+
+    @staticmethod
+    def _read_chain_dir(chain_dir):
+        for file_name in sorted(listdir(chain_dir), key=block_file_key):
+            with open_file(os.path.join(chain_dir, file_name), "r") as f:
+                yield file_name, json.load(f)
+
+    @timed("merge")
+    def _merge(self, named_blocks, use_bloom):
+        started = time.perf_counter()
+        known_hashes = self._load_known_hashes(use_bloom)
+        merged_hashes = set()
+        report = {"added": 0, "skipped": 0, "rejected": 0}
+
+        for file_name, block in named_blocks:
+            if self._is_known(block["block_hash"], block["block_number"], known_hashes):
+                report["skipped"] += 1
                 print(f"Block {block['block_number']} already exists in the main chain.")
+            elif not self._is_valid_block(block, known_hashes, merged_hashes):
+                report["rejected"] += 1
+                print(f"Block {block['block_number']} is rejected: wrong hash or unknown previous block.")
+            else:
+                target = os.path.join(self.blockchain_dir, file_name)
+                # a different fork may already use this file name
+                if os.path.exists(target):
+                    target = os.path.join(self.blockchain_dir,
+                                          f"block_{block['block_number']}_{block['block_hash'][:8]}.json")
+                self.write_block(block, target)
+                merged_hashes.add(block["block_hash"])
+                report["added"] += 1
+                print(f"Block {block['block_number']} added to the main chain.")
+
+        report["seconds"] = time.perf_counter() - started
+        print(f"Merge finished: {report['added']} added, {report['skipped']} skipped, "
+              f"{report['rejected']} rejected in {report['seconds']:.3f} s")
+        return report
+
+    @timed("load_known_hashes")
+    def _load_known_hashes(self, use_bloom):
+        # the main chain is read once, after that every lookup is in memory
+        self.flush()
+        file_names = [name for name in listdir(self.blockchain_dir) if name.startswith("block_")]
+        known_hashes = BloomFilter(len(file_names)) if use_bloom else set()
+        for file_name in file_names:
+            with open_file(os.path.join(self.blockchain_dir, file_name), "r") as f:
+                known_hashes.add(json.load(f)["block_hash"])
+        self._files_by_number = None
+        return known_hashes
+
+    def _is_known(self, block_hash, block_number, known_hashes):
+        if block_hash not in known_hashes:
+            return False
+        if isinstance(known_hashes, set):
+            return True
+        # a Bloom filter can give a false positive, so the files with the same number are checked
+        if self._files_by_number is None:
+            self._files_by_number = {}
+            for file_name in listdir(self.blockchain_dir):
+                if file_name.startswith("block_"):
+                    self._files_by_number.setdefault(block_file_key(file_name)[0], []).append(file_name)
+        for file_name in self._files_by_number.get(block_number, []):
+            with open_file(os.path.join(self.blockchain_dir, file_name), "r") as f:
+                if json.load(f)["block_hash"] == block_hash:
+                    return True
+        return False
 
+    def _is_valid_block(self, block, known_hashes, merged_hashes):
+        if self._calculate_hash(dict(block, block_hash="")) != block["block_hash"]:
+            return False
+        if "difficulty" in block and not meets_difficulty(block["block_hash"], block["difficulty"]):
+            return False
+        if block["block_number"] == 0:
+            return block["previous_hash"] == "0"
+        return (block["previous_hash"] in merged_hashes
+                or self._is_known(block["previous_hash"], block["block_number"] - 1, known_hashes))
+
+    @timed("is_block_in_chain")
     def is_block_in_chain(self, block):
-        for file_name in os.listdir(self.blockchain_dir):
-            with open(os.path.join(self.blockchain_dir, file_name), "r") as f:
+        self.flush()
+        for file_name in listdir(self.blockchain_dir):
+            with open_file(os.path.join(self.blockchain_dir, file_name), "r") as f:
                 existing_block = json.load(f)
                 if existing_block["block_hash"] == block["block_hash"]:
                     return True
         return False
 
 
-# Task 1
-blockchain_dir = "blockchain_data"
-bc = Blockchain(blockchain_dir)
+if __name__ == "__main__":
+    # Task 1
+    blockchain_dir = "blockchain_data"
+    bc = Blockchain(blockchain_dir)
 
-genesis_block = bc.create_block("0", 0)
-bc.write_block(genesis_block, os.path.join(blockchain_dir, "block_0.json"))
+    genesis_block = bc.create_block("0", 0)
+    bc.write_block(genesis_block, os.path.join(blockchain_dir, "block_0.json"))
 
-# Добавление блоков в разные цепочки (ветвление)
-block_1 = bc.create_block(genesis_block["block_hash"], 1)
-bc.write_block(block_1, os.path.join(blockchain_dir, "block_1.json"))
+    # Добавление блоков в разные цепочки (ветвление)
+    block_1 = bc.create_block(genesis_block["block_hash"], 1)
+    bc.write_block(block_1, os.path.join(blockchain_dir, "block_1.json"))
 
-# Ветка 1
-block_2a = bc.create_block(block_1["block_hash"], 2)
-bc.write_block(block_2a, os.path.join(blockchain_dir, "block_2a.json"))
+    # Ветка 1
+    block_2a = bc.create_block(block_1["block_hash"], 2)
+    bc.write_block(block_2a, os.path.join(blockchain_dir, "block_2a.json"))
 
-# Ветка 2
-block_2b = bc.create_block(block_1["block_hash"], 2)
-bc.write_block(block_2b, os.path.join(blockchain_dir, "block_2b.json"))
+    # Ветка 2
+    block_2b = bc.create_block(block_1["block_hash"], 2)
+    bc.write_block(block_2b, os.path.join(blockchain_dir, "block_2b.json"))
 
-# Ветка 1
-block_3a = bc.create_block(block_2a["block_hash"], 3)
-bc.write_block(block_3a, os.path.join(blockchain_dir, "block_3a.json"))
+    # Ветка 1
+    block_3a = bc.create_block(block_2a["block_hash"], 3)
+    bc.write_block(block_3a, os.path.join(blockchain_dir, "block_3a.json"))
 
-# Ветка 2
-block_3b = bc.create_block(block_2b["block_hash"], 3)
-bc.write_block(block_3b, os.path.join(blockchain_dir, "block_3b.json"))
+    # Ветка 2
+    block_3b = bc.create_block(block_2b["block_hash"], 3)
+    bc.write_block(block_3b, os.path.join(blockchain_dir, "block_3b.json"))
 
 
-# Task 2
-bc_with_merge = BlockchainWithMerge(blockchain_dir)
+    # Task 2
+    bc_with_merge = BlockchainWithMerge(blockchain_dir)
 
-short_chain_dir = "blockchain_data_short"
-if not os.path.exists(short_chain_dir):
-    os.makedirs(short_chain_dir)
-bc_with_merge.validate_and_merge_chain(short_chain_dir)
\ No newline at end of file
+    short_chain_dir = "blockchain_data_short"
+    if not os.path.exists(short_chain_dir):
+        os.makedirs(short_chain_dir)
+    bc_with_merge.validate_and_merge_chain(short_chain_dir)
@@ -0,0 +1,233 @@
+import struct
+
+from hashing import Hasher
+
+MAGIC = b"BLK3"
+# every format decode() reads: BLK1 - before Merkle roots, BLK2 - before signer and signature
+MAGICS = (b"BLK1", b"BLK2", MAGIC)
+
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+DEFAULT_HASHER = Hasher("md5")
+
+
+def _pack_bytes(out, data):
+    out += _U32.pack(len(data))
+    out += data
+
+
+def _pack_value(out, value):
+    # one tag byte per value, so every JSON value survives the round trip with its type
+    if value is None:
+        out += b"n"
+    elif value is True:
+        out += b"t"
+    elif value is False:
+        out += b"f"
+    elif isinstance(value, int):
+        if -2 ** 63 <= value < 2 ** 63:
+            out += b"i" + _I64.pack(value)
+        else:
+            out += b"I"
+            _pack_bytes(out, str(value).encode())
+    elif isinstance(value, float):
+        out += b"d" + _F64.pack(value)
+    elif isinstance(value, str):
+        out += b"s"
+        _pack_bytes(out, value.encode())
+    elif isinstance(value, (list, tuple)):
+        out += b"l" + _U32.pack(len(value))
+        for item in value:
+            _pack_value(out, item)
+    elif isinstance(value, dict):
+        # the keys are sorted like json.dumps(sort_keys=True), equal dicts always have one encoding
+        out += b"m" + _U32.pack(len(value))
+        for key, item in sorted(((str(key), item) for key, item in value.items()), key=lambda pair: pair[0]):
+            _pack_bytes(out, key.encode())
+            _pack_value(out, item)
+    else:
+        raise TypeError(f"Can't encode value of type {type(value).__name__}")
+
+
+def _unpack_bytes(data, offset):
+    (length,) = _U32.unpack_from(data, offset)
+    offset += _U32.size
+    return bytes(data[offset:offset + length]), offset + length
+
+
+def _unpack_value(data, offset):
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b"n":
+        return None, offset
+    if tag == b"t":
+        return True, offset
+    if tag == b"f":
+        return False, offset
+    if tag == b"i":
+        return _I64.unpack_from(data, offset)[0], offset + _I64.size
+    if tag == b"I":
+        raw, offset = _unpack_bytes(data, offset)
+        return int(raw), offset
+    if tag == b"d":
+        return _F64.unpack_from(data, offset)[0], offset + _F64.size
+    if tag == b"s":
+        raw, offset = _unpack_bytes(data, offset)
+        return raw.decode(), offset
+    if tag == b"l":
+        (count,) = _U32.unpack_from(data, offset)
+        offset += _U32.size
+        items = []
+        for _ in range(count):
+            item, offset = _unpack_value(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == b"m":
+        (count,) = _U32.unpack_from(data, offset)
+        offset += _U32.size
+        items = {}
+        for _ in range(count):
+            key, offset = _unpack_bytes(data, offset)
+            items[key.decode()], offset = _unpack_value(data, offset)
+        return items, offset
+    raise ValueError(f"Unknown value tag {tag!r}")
+
+
+class Block:
+    """Block of the Module2 chain with a canonical binary encoding.
+
+    The encoding (length-prefixed fields, tagged values) is built once and
+    reused for hashing and for storage, so a block is never serialized twice.
+    Blocks are treated as immutable after the encoding is built.
+    """
+
+    __slots__ = ("index", "date", "previous_hash", "transactions", "merkle_root", "block_hash",
+                 "signer", "signature", "_parts")
+
+    FIELDS = ("index", "date", "previous_hash", "transactions", "merkle_root", "block_hash", "signer", "signature")
+    # fields left out of to_dict() while they are None
+    OPTIONAL_FIELDS = ("merkle_root", "signer", "signature")
+    # fields outside of the hashed body
+    SEAL_FIELDS = ("block_hash", "signer", "signature")
+
+    def __init__(self, index, date, previous_hash, transactions, block_hash="", merkle_root=None,
+                 signer=None, signature=None):
+        self.index = index
+        self.date = date
+        self.previous_hash = previous_hash
+        self.transactions = transactions
+        # None for the blocks created before Merkle roots were introduced
+        self.merkle_root = merkle_root
+        self.block_hash = block_hash
+        # public key of the producer and its signature of block_hash, None for unsigned blocks
+        self.signer = signer
+        self.signature = signature
+        self._parts = None
+
+    @classmethod
+    def from_dict(cls, data):
+        extra = set(data) - set(cls.FIELDS)
+        if extra:
+            raise ValueError(f"Unknown block fields: {sorted(extra)}")
+        return cls(data["index"], data["date"], data["previous_hash"], data["transactions"],
+                   data.get("block_hash", ""), data.get("merkle_root"), data.get("signer"), data.get("signature"))
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS
+                if field not in self.OPTIONAL_FIELDS or getattr(self, field) is not None}
+
+    # dict-style access keeps the code written for JSON blocks working
+    def __getitem__(self, field):
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field, default=None):
+        return getattr(self, field) if field in self.FIELDS else default
+
+    def __setitem__(self, field, value):
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        setattr(self, field, value)
+        if field not in self.SEAL_FIELDS:
+            self._parts = None
+
+    def __eq__(self, other):
+        return isinstance(other, Block) and self.encode() == other.encode()
+
+    def __repr__(self):
+        return f"Block(index={self.index}, block_hash={self.block_hash!r})"
+
+    def _encoded(self):
+        # (index, date and previous_hash, merkle_root, transactions) encoded once for hashing and storage
+        if self._parts is None:
+            head = bytearray(_U64.pack(self.index))
+            _pack_bytes(head, self.date.encode())
+            _pack_bytes(head, self.previous_hash.encode())
+            merkle = bytearray()
+            _pack_value(merkle, self.merkle_root)
+            transactions = bytearray()
+            _pack_value(transactions, self.transactions)
+            self._parts = (bytes(head), bytes(merkle), bytes(transactions))
+        return self._parts
+
+    def body(self):
+        """Encoding of every field except the seal fields."""
+        head, merkle, transactions = self._encoded()
+        return head + merkle + transactions
+
+    def header(self):
+        head, merkle, _ = self._encoded()
+        return head + merkle
+
+    def hash_input(self):
+        head, merkle, transactions = self._encoded()
+        # the Merkle root commits to the transactions, so only the header has to be hashed;
+        # a block without one is hashed over its BLK1 body, like before Merkle roots were added
+        return head + merkle if self.merkle_root is not None else head + transactions
+
+    def compute_hash(self, hasher=DEFAULT_HASHER):
+        return hasher.hash_bytes(self.hash_input())
+
+    def encode(self):
+        out = bytearray(MAGIC)
+        out += self.body()
+        _pack_bytes(out, self.block_hash.encode())
+        _pack_value(out, self.signer)
+        _pack_value(out, self.signature)
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, data):
+        magic = bytes(data[:len(MAGIC)])
+        if magic not in MAGICS:
+            raise ValueError("Not an encoded block")
+        # older records lack the fields added after them, the fields are None for such blocks
+        version = MAGICS.index(magic) + 1
+        offset = len(MAGIC)
+        (index,) = _U64.unpack_from(data, offset)
+        offset += _U64.size
+        date, offset = _unpack_bytes(data, offset)
+        previous_hash, offset = _unpack_bytes(data, offset)
+        head_end = offset
+        merkle_root = None
+        if version >= 2:
+            merkle_root, offset = _unpack_value(data, offset)
+        merkle_end = offset
+        transactions, offset = _unpack_value(data, offset)
+        transactions_end = offset
+        block_hash, offset = _unpack_bytes(data, offset)
+        signer = signature = None
+        if version >= 3:
+            signer, offset = _unpack_value(data, offset)
+            signature, offset = _unpack_value(data, offset)
+
+        block = cls(index, date.decode(), previous_hash.decode(), transactions, block_hash.decode(),
+                    merkle_root, signer, signature)
+        block._parts = (bytes(data[len(MAGIC):head_end]),
+                        bytes(data[head_end:merkle_end]) if version >= 2 else b"n",
+                        bytes(data[merkle_end:transactions_end]))
+        return block
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+
+class BlockCache:
+    """Read-through LRU cache of parsed blocks, bounded by the total size of their files.
+
+    get(key, load, version) returns the cached value or calls load(), which
+    returns a (value, size in bytes) pair. version (e.g. the mtime and size of
+    the file) is compared with the one the value was loaded with, a changed
+    version is a miss. The values are shared between the callers and must not
+    be modified. Writers call invalidate() for the block they write; stats()
+    gives the numbers for sizing max_bytes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, load, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] == version:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+        value, size = load()
+        if size <= self.max_bytes:
+            with self._lock:
+                self._remove(key)
+                self._entries[key] = (value, size, version)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted[1]
+                    self._evictions += 1
+        return value
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / requests if requests else 0.0,
+                "evictions": self._evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
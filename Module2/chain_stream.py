@@ -0,0 +1,132 @@
+"""Streaming export and import of chains as one NDJSON or length-prefixed binary stream.
+
+Blocks are processed one at a time, so memory use doesn't depend on the
+length of the chain and the stream can go through a pipe:
+
+    python chain_stream.py export blocks --gzip | ssh node python chain_stream.py import blocks --gzip
+    python chain_stream.py export blockchain_data --forks | python chain_stream.py merge main_chain
+"""
+import argparse
+import gzip
+import json
+import struct
+import sys
+
+from block import MAGICS, Block
+
+FORMATS = ("ndjson", "binary")
+
+_LENGTH = struct.Struct("<I")
+
+
+class ChainLinkError(ValueError):
+    pass
+
+
+def _encode(block, fmt):
+    if fmt == "binary":
+        data = block.encode() if isinstance(block, Block) else json.dumps(block, separators=(",", ":")).encode()
+        return _LENGTH.pack(len(data)) + data
+    if isinstance(block, Block):
+        block = block.to_dict()
+    return json.dumps(block, separators=(",", ":")).encode() + b"\n"
+
+
+def export_chain(blocks, out, fmt="ndjson", compress=False):
+    """Write the blocks into a binary file object, returns the number of blocks."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    stream = gzip.GzipFile(fileobj=out, mode="wb") if compress else out
+    count = 0
+    for block in blocks:
+        stream.write(_encode(block, fmt))
+        count += 1
+    if compress:
+        stream.close()
+    out.flush()
+    return count
+
+
+def _read_records(stream, fmt):
+    if fmt == "ndjson":
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+        return
+    while True:
+        header = stream.read(_LENGTH.size)
+        if not header:
+            return
+        if len(header) < _LENGTH.size:
+            raise ValueError("Truncated block stream")
+        (length,) = _LENGTH.unpack(header)
+        data = stream.read(length)
+        if len(data) < length:
+            raise ValueError("Truncated block stream")
+        yield Block.decode(data) if data.startswith(MAGICS) else json.loads(data)
+
+
+def import_chain(source, fmt="ndjson", compress=False, previous_hash=None, check_links=True, compute_hash=None):
+    """Yield the blocks of a stream, checking that each one links to the block before it.
+
+    previous_hash is the hash the first block must link to (for a height range
+    that continues an existing chain). compute_hash(block) recomputes the hash
+    of a block: without it the links are checked against the block_hash the
+    stream supplies, which the stream can forge.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    stream = gzip.GzipFile(fileobj=source, mode="rb") if compress else source
+    for block in _read_records(stream, fmt):
+        if compute_hash is not None and compute_hash(block) != block["block_hash"]:
+            raise ChainLinkError(f"Block {block.get('index', block.get('block_number'))} has a wrong block_hash")
+        if check_links and previous_hash is not None and block["previous_hash"] != previous_hash:
+            raise ChainLinkError(f"Block {block.get('index', block.get('block_number'))} "
+                                 f"doesn't link to the previous block")
+        previous_hash = block["block_hash"]
+        yield block
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming export/import of chains")
+    parser.add_argument("command", choices=["export", "import", "merge"],
+                        help="import appends to a Task2_1 chain, merge adds blocks to a Task2_2 chain")
+    parser.add_argument("blocks_dir")
+    parser.add_argument("--forks", action="store_true", help="export a Task2_2 chain with forks")
+    parser.add_argument("--storage", choices=["files", "segments"], default="files")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--end", type=int)
+    args = parser.parse_args()
+
+    # the Blockchain classes import this module, so they are imported by the command line only
+    if args.command == "merge" or args.forks:
+        from Task2_2 import BlockchainWithMerge
+        blockchain = BlockchainWithMerge(args.blocks_dir)
+        if args.command == "export":
+            count = blockchain.export_stream(sys.stdout.buffer, args.format, args.gzip)
+            print(f"Exported {count} blocks", file=sys.stderr)
+        elif args.command == "merge":
+            # forks don't link one after another, the merge checks every block against the known ones
+            blockchain.merge_blocks(import_chain(sys.stdin.buffer, args.format, args.gzip, check_links=False))
+        else:
+            parser.error("a chain with forks can only be exported or merged")
+        return
+
+    from storage import SegmentStorage
+    from Task2_1 import Blockchain
+    storage = SegmentStorage(args.blocks_dir) if args.storage == "segments" else None
+    blockchain = Blockchain(args.blocks_dir, storage=storage)
+    # progress messages go to stderr, stdout may be the stream itself
+    if args.command == "export":
+        count = blockchain.export_stream(sys.stdout.buffer, args.start, args.end, args.format, args.gzip)
+        print(f"Exported {count} blocks", file=sys.stderr)
+    else:
+        count = blockchain.import_stream(sys.stdin.buffer, args.format, args.gzip)
+        print(f"Imported {count} blocks", file=sys.stderr)
+    blockchain.close()
+
+
+if __name__ == "__main__":
+    main()
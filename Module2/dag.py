@@ -0,0 +1,92 @@
+class BlockNode:
+    __slots__ = ("block_hash", "parent", "height", "children")
+
+    def __init__(self, block_hash, parent, height):
+        self.block_hash = block_hash
+        self.parent = parent
+        self.height = height
+        self.children = 0
+
+
+class BlockDag:
+    """In-memory index of all branches: block_hash -> node with a parent pointer and height.
+
+    The set of tips and the best (longest) tip are maintained on every add,
+    so fork choice is O(1), and ancestor lookups walk parent pointers only.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.tips = set()
+        self.best_tip = None
+        self._orphans = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.nodes
+
+    def add(self, block):
+        """Add a block; returns a reorg report if the best tip moved to another branch."""
+        if block["block_hash"] in self.nodes:
+            return None
+        parent = self.nodes.get(block["previous_hash"])
+        if parent is None and block["previous_hash"] != "0":
+            # the parent hasn't been seen yet, the block is attached when it arrives
+            self._orphans.setdefault(block["previous_hash"], []).append(block)
+            return None
+
+        reorg = self._attach(block["block_hash"], parent)
+        waiting = self._orphans.pop(block["block_hash"], [])
+        while waiting:
+            orphan = waiting.pop()
+            reorg = self._attach(orphan["block_hash"], self.nodes[orphan["previous_hash"]]) or reorg
+            waiting.extend(self._orphans.pop(orphan["block_hash"], []))
+        return reorg
+
+    def _attach(self, block_hash, parent):
+        node = BlockNode(block_hash, parent, parent.height + 1 if parent else 0)
+        self.nodes[block_hash] = node
+        if parent is not None:
+            parent.children += 1
+            self.tips.discard(parent.block_hash)
+        self.tips.add(block_hash)
+
+        old_best = self.best_tip
+        if old_best is None or node.height > self.nodes[old_best].height:
+            self.best_tip = block_hash
+            if old_best is not None and parent is not None and parent.block_hash != old_best:
+                return self.reorg(old_best, block_hash)
+        return None
+
+    def common_ancestor(self, first_hash, second_hash):
+        first, second = self.nodes[first_hash], self.nodes[second_hash]
+        while first.height > second.height:
+            first = first.parent
+        while second.height > first.height:
+            second = second.parent
+        while first is not second:
+            first, second = first.parent, second.parent
+        # None means the branches start from different genesis blocks
+        return first.block_hash if first else None
+
+    def path(self, from_hash, to_hash):
+        """Hashes from to_hash (inclusive) back to its ancestor from_hash (exclusive), oldest first."""
+        result = []
+        node = self.nodes[to_hash]
+        while node is not None and node.block_hash != from_hash:
+            result.append(node.block_hash)
+            node = node.parent
+        return result[::-1]
+
+    def reorg(self, old_tip, new_tip):
+        ancestor = self.common_ancestor(old_tip, new_tip)
+        return {
+            "common_ancestor": ancestor,
+            "removed": self.path(ancestor, old_tip),
+            "added": self.path(ancestor, new_tip)
+        }
+
+    def best_chain(self):
+        return self.path(None, self.best_tip) if self.best_tip else []
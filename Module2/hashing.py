@@ -0,0 +1,68 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import METRICS, open_file
+
+ALGORITHMS = ("md5", "sha256", "blake2b")
+
+CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 256
+# hashlib releases the GIL only while it hashes inputs larger than 2047 bytes
+GIL_RELEASE_SIZE = 2048
+
+
+class Hasher:
+    """Hashing shared by all Blockchain classes, the algorithm is chosen once per chain.
+
+    Files and large inputs are hashed on a thread pool, hashlib releases the
+    GIL for them. Small inputs such as block headers keep the GIL, so they are
+    hashed in the calling thread, threads would only add overhead.
+    """
+
+    def __init__(self, algorithm="md5"):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"algorithm must be one of {ALGORITHMS}")
+        self.algorithm = algorithm
+        self._constructor = getattr(hashlib, algorithm)
+
+    def new(self):
+        return self._constructor()
+
+    def hash_bytes(self, data):
+        if METRICS.enabled:
+            METRICS.count("hashes")
+            METRICS.count("bytes_hashed", len(data))
+        return self._constructor(data).hexdigest()
+
+    def hash_stream(self, stream, chunk_size=CHUNK_SIZE):
+        """Hash a file object chunk by chunk, without reading it fully into memory."""
+        result = self._constructor()
+        size = 0
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            result.update(chunk)
+            size += len(chunk)
+        if METRICS.enabled:
+            METRICS.count("hashes")
+            METRICS.count("bytes_hashed", size)
+        return result.hexdigest()
+
+    def hash_file(self, path):
+        with open_file(path, "rb") as f:
+            return self.hash_stream(f)
+
+    def _map(self, func, items, workers):
+        items = list(items)
+        batches = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+        # small blocks are hashed in batches, one task per block would cost more than the hashing
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda batch: [func(item) for item in batch], batches)
+            return [digest for batch in results for digest in batch]
+
+    def hash_many(self, datas, workers=None):
+        datas = list(datas)
+        if sum(map(len, datas)) < GIL_RELEASE_SIZE * len(datas):
+            return [self.hash_bytes(data) for data in datas]
+        return self._map(self.hash_bytes, datas, workers)
+
+    def hash_files(self, paths, workers=None):
+        return self._map(self.hash_file, paths, workers)
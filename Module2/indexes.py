@@ -0,0 +1,233 @@
+import bisect
+import hashlib
+import json
+import math
+import os
+import struct
+import zlib
+from array import array
+from datetime import datetime, timezone
+
+
+def _tail_crc(path, offset, size=4096):
+    # checksum of the bytes just before offset: a log rewritten after a snapshot doesn't match it
+    with open(path, "rb") as f:
+        f.seek(max(0, offset - size))
+        return zlib.crc32(f.read(min(offset, size)))
+
+
+def _restorable(path, state):
+    return (state is not None and os.path.exists(path) and state["offset"] <= os.path.getsize(path)
+            and _tail_crc(path, state["offset"]) == state["crc"])
+
+
+class InvertedIndex:
+    """Persistent inverted index: key -> list of block heights.
+
+    Every indexed block is appended to a log file as one JSON line and the log
+    is replayed into a dict when the index is opened, so lookups never have to
+    touch the block bodies. With a state from state() (kept in a snapshot)
+    only the part of the log written after it is replayed.
+    """
+
+    def __init__(self, path, state=None):
+        self.path = path
+        self.height = 0
+        self._postings = {}
+        # size of the part of the log that is already in _postings
+        self._offset = 0
+        self._load(state)
+        self._file = open(self.path, "a")
+
+    def _load(self, state=None):
+        if not os.path.exists(self.path):
+            return
+        if _restorable(self.path, state):
+            self._postings = {tuple(key): heights for key, heights in state["postings"]}
+            self.height, self._offset = state["height"], state["offset"]
+        self._replay()
+        if self._offset < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(self._offset)
+
+    def _replay(self):
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # a torn line after an interrupted write
+                if entry["h"] >= self.height:
+                    self._add_postings(entry["h"], entry["k"])
+                self._offset += len(line)
+
+    def refresh(self):
+        """Read the entries other processes have appended to the log since the last call."""
+        self._replay()
+
+    def _add_postings(self, height, keys):
+        for key in keys:
+            self._postings.setdefault(tuple(key), []).append(height)
+        self.height = height + 1
+
+    def add(self, height, keys):
+        keys = list(dict.fromkeys(tuple(key) for key in keys))
+        self._file.write(json.dumps({"h": height, "k": keys}) + "\n")
+        self._file.flush()
+        self._offset = os.fstat(self._file.fileno()).st_size
+        self._add_postings(height, keys)
+
+    def find(self, key):
+        return list(self._postings.get(tuple(key), []))
+
+    def state(self):
+        self._file.flush()
+        offset = os.path.getsize(self.path)
+        # the keys are tuples, so the postings are kept as [key, heights] pairs (JSON has string keys only)
+        return {"offset": offset, "crc": _tail_crc(self.path, offset), "height": self.height,
+                "postings": [[list(key), heights] for key, heights in self._postings.items()]}
+
+    def reset(self):
+        self._file.close()
+        self._file = open(self.path, "w")
+        self._postings.clear()
+        self.height = 0
+        self._offset = 0
+
+    def close(self):
+        self._file.close()
+
+
+def to_timestamp(value):
+    """Seconds for a block date: a datetime or an ISO string like "2024-11-10" or str(datetime.now())."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    # naive dates are compared as UTC, only the order of the blocks matters here
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class TimeIndex:
+    """Persistent time index: sorted arrays of timestamps and block heights.
+
+    (timestamp, height) records are appended to a binary file and loaded into
+    two parallel arrays, range queries are two binary searches. With a state
+    from state() the sorted arrays are taken as they are and only the records
+    written after it are inserted.
+    """
+
+    RECORD = struct.Struct("<dQ")
+
+    def __init__(self, path, state=None):
+        self.path = path
+        self.height = 0
+        self._times = array("d")
+        self._heights = array("Q")
+        self._offset = 0
+        self._load(state)
+        self._file = open(self.path, "ab")
+
+    def _read_new(self):
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # a torn record after an interrupted write is dropped
+        data = data[:len(data) - len(data) % self.RECORD.size]
+        self._offset += len(data)
+        return list(self.RECORD.iter_unpack(data))
+
+    def _load(self, state=None):
+        if not os.path.exists(self.path):
+            return
+        if _restorable(self.path, state):
+            self._times.frombytes(state["times"])
+            self._heights.frombytes(state["heights"])
+            self.height, self._offset = state["height"], state["offset"]
+            for timestamp, height in self._read_new():
+                self._insert(timestamp, height)
+        else:
+            records = self._read_new()
+            self.height = max(height for _, height in records) + 1 if records else 0
+            records = sorted(record for record in records if not math.isnan(record[0]))
+            self._times = array("d", (timestamp for timestamp, _ in records))
+            self._heights = array("Q", (height for _, height in records))
+        if self._offset < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(self._offset)
+
+    def refresh(self):
+        """Insert the records other processes have appended since the last call."""
+        for timestamp, height in self._read_new():
+            if height >= self.height:
+                self._insert(timestamp, height)
+
+    def __len__(self):
+        return len(self._times)
+
+    def add(self, height, date):
+        try:
+            timestamp = to_timestamp(date)
+        except (TypeError, ValueError):
+            # a date that isn't ISO (Module1 takes it as typed) can't be found by range,
+            # its record only keeps the height of the index in step with the chain
+            timestamp = math.nan
+        self._file.write(self.RECORD.pack(timestamp, height))
+        self._file.flush()
+        self._offset += self.RECORD.size
+        self._insert(timestamp, height)
+
+    def _insert(self, timestamp, height):
+        self.height = max(self.height, height + 1)
+        if math.isnan(timestamp):
+            return
+        # blocks normally come in time order, so this is an append
+        position = bisect.bisect_right(self._times, timestamp)
+        self._times.insert(position, timestamp)
+        self._heights.insert(position, height)
+
+    def range(self, start, end):
+        """Heights of the blocks with start <= date <= end, in time order."""
+        first = bisect.bisect_left(self._times, to_timestamp(start))
+        last = bisect.bisect_right(self._times, to_timestamp(end))
+        return self._heights[first:last].tolist()
+
+    def state(self):
+        self._file.flush()
+        offset = os.path.getsize(self.path)
+        return {"offset": offset, "crc": _tail_crc(self.path, offset), "height": self.height,
+                "times": self._times.tobytes(), "heights": self._heights.tobytes()}
+
+    def reset(self):
+        self._file.close()
+        self._file = open(self.path, "wb")
+        self._times = array("d")
+        self._heights = array("Q")
+        self.height = 0
+        self._offset = 0
+
+    def close(self):
+        self._file.close()
+
+
+class BloomFilter:
+    """Set of strings with false positives but no false negatives, a few bits per item."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
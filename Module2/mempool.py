@@ -0,0 +1,77 @@
+import json
+import time
+
+
+def transaction_key(transaction):
+    # the same duplicate rule as the search_transaction check: one (buyer, seller) pair per chain
+    return transaction["buyer"], transaction["seller"]
+
+
+class Mempool:
+    """Buffer of pending transactions that are sealed into blocks in batches.
+
+    A block is sealed when the pool reaches max_transactions or max_bytes, or
+    when its oldest transaction is older than max_age seconds. Duplicates are
+    rejected against the blockchain's transaction index and the pending set.
+    """
+
+    def __init__(self, blockchain, max_transactions=1000, max_bytes=1024 * 1024, max_age=1.0,
+                 key=transaction_key):
+        self.blockchain = blockchain
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.key = key
+        self.stats = {"accepted": 0, "duplicates": 0, "blocks": 0}
+        self._pending = []
+        self._pending_keys = set()
+        self._pending_bytes = 0
+        self._oldest = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _is_duplicate(self, key):
+        if key in self._pending_keys:
+            return True
+        # the blocks still queued in the chain's writer count too, see Blockchain.transaction_heights
+        return bool(self.blockchain.transaction_heights(key))
+
+    def add(self, transaction):
+        key = self.key(transaction)
+        if self._is_duplicate(key):
+            self.stats["duplicates"] += 1
+            return False
+
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending.append(transaction)
+        self._pending_keys.add(key)
+        self._pending_bytes += len(json.dumps(transaction))
+        self.stats["accepted"] += 1
+
+        if (len(self._pending) >= self.max_transactions or self._pending_bytes >= self.max_bytes
+                or time.monotonic() - self._oldest >= self.max_age):
+            self.seal()
+        return True
+
+    def add_many(self, transactions):
+        return sum(self.add(transaction) for transaction in transactions)
+
+    def seal_expired(self):
+        """Seal the pending transactions if they waited longer than max_age (for idle streams)."""
+        if self._pending and time.monotonic() - self._oldest >= self.max_age:
+            self.seal()
+
+    def seal(self):
+        if not self._pending:
+            return
+        self.blockchain.add_block(self._pending)
+        self.stats["blocks"] += 1
+        self._pending = []
+        self._pending_keys = set()
+        self._pending_bytes = 0
+        self._oldest = None
+
+    def close(self):
+        self.seal()
@@ -0,0 +1,55 @@
+import json
+
+from hashing import Hasher
+
+# different prefixes for leaves and inner nodes, so a node can't be passed off as a transaction
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+DEFAULT_HASHER = Hasher("md5")
+
+
+def leaf_hash(transaction, hasher=DEFAULT_HASHER):
+    data = json.dumps(transaction, sort_keys=True, separators=(",", ":")).encode()
+    return hasher.hash_bytes(LEAF_PREFIX + data)
+
+
+def node_hash(left, right, hasher=DEFAULT_HASHER):
+    return hasher.hash_bytes(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right))
+
+
+def _next_level(level, hasher):
+    # an odd node is carried up unchanged instead of being paired with a copy of itself
+    return [node_hash(level[i], level[i + 1], hasher) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)]
+
+
+def merkle_root(transactions, hasher=DEFAULT_HASHER):
+    level = [leaf_hash(transaction, hasher) for transaction in transactions]
+    if not level:
+        return hasher.hash_bytes(b"")
+    while len(level) > 1:
+        level = _next_level(level, hasher)
+    return level[0]
+
+
+def merkle_proof(transactions, position, hasher=DEFAULT_HASHER):
+    """Sibling hashes from the leaf up to the root: a list of [side, hash] pairs."""
+    if not 0 <= position < len(transactions):
+        raise IndexError(f"Transaction {position} does not exist")
+    proof = []
+    level = [leaf_hash(transaction, hasher) for transaction in transactions]
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append(["left" if sibling < position else "right", level[sibling]])
+        level = _next_level(level, hasher)
+        position //= 2
+    return proof
+
+
+def verify_proof(transaction, proof, root, hasher=DEFAULT_HASHER):
+    current = leaf_hash(transaction, hasher)
+    for side, sibling in proof:
+        current = node_hash(sibling, current, hasher) if side == "left" else node_hash(current, sibling, hasher)
+    return current == root
@@ -0,0 +1,211 @@
+"""Counters and latency histograms for the Blockchain classes of Module1 and Module2.
+
+Collection is off by default and every hook starts with a check of
+METRICS.enabled, so a disabled hook costs one attribute lookup. It is turned
+on with METRICS.enable() or the BLOCKCHAIN_METRICS=1 environment variable:
+
+    METRICS.enable()
+    blockchain.add_block(transactions)
+    print(METRICS.to_prometheus())
+"""
+import bisect
+import cProfile
+import contextlib
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+# upper bounds of the latency buckets, in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+COUNTERS = ("hashes", "bytes_hashed", "bytes_read", "bytes_written", "files_opened", "listdir_calls")
+
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            # operation -> [counts per bucket, sum of seconds, number of calls]
+            self.histograms = {}
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, operation, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(operation)
+            if histogram is None:
+                histogram = self.histograms[operation] = [[0] * len(BUCKETS), 0.0, 0]
+            histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "operations": {
+                    operation: {
+                        "count": calls,
+                        "sum_seconds": total,
+                        "buckets": {str(bound): count for bound, count in zip(BUCKETS, buckets)}
+                    }
+                    for operation, (buckets, total, calls) in self.histograms.items()
+                }
+            }
+
+    def to_json(self, indent=4):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self, prefix="blockchain"):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        name = f"{prefix}_operation_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for operation, histogram in sorted(snapshot["operations"].items()):
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == "inf" else bound
+                lines.append(f'{name}_bucket{{operation="{operation}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{operation="{operation}"}} {histogram["sum_seconds"]}')
+            lines.append(f'{name}_count{{operation="{operation}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    @contextlib.contextmanager
+    def profile(self, path=None, sort="cumulative", limit=30):
+        """cProfile capture of the block; the stats go to path or into the yielded dict under "text"."""
+        profiler = cProfile.Profile()
+        result = {}
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            if path:
+                profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+            result["text"] = out.getvalue()
+
+
+METRICS = Metrics(enabled=os.environ.get("BLOCKCHAIN_METRICS") == "1")
+
+
+def timed(operation):
+    """Decorator recording the latency of a method in the operation histogram.
+
+    A generator is measured over all of its items: the time spent producing
+    them is recorded once, when it is exhausted or closed, the time the
+    consumer spends between the items isn't counted.
+    """
+    def decorate(func):
+        if inspect.isgeneratorfunction(func):
+            return _timed_generator(operation, func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                METRICS.observe(operation, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def _timed_generator(operation, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not METRICS.enabled:
+            return (yield from func(*args, **kwargs))
+        generator = func(*args, **kwargs)
+        seconds = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    seconds += time.perf_counter() - started
+                yield item
+        finally:
+            generator.close()
+            METRICS.observe(operation, seconds)
+    return wrapper
+
+
+class _CountingFile:
+    """File wrapper counting what is read and written (characters in text mode)."""
+
+    def __init__(self, file):
+        self._file = file
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        METRICS.count("bytes_read", len(data))
+        return data
+
+    def write(self, data):
+        METRICS.count("bytes_written", len(data))
+        return self._file.write(data)
+
+    def __iter__(self):
+        for line in self._file:
+            METRICS.count("bytes_read", len(line))
+            yield line
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+def open_file(path, mode="r"):
+    """open() that counts opened files and bytes when metrics are enabled."""
+    if not METRICS.enabled:
+        return open(path, mode)
+    METRICS.count("files_opened")
+    return _CountingFile(open(path, mode))
+
+
+def listdir(path):
+    if not METRICS.enabled:
+        return os.listdir(path)
+    started = time.perf_counter()
+    names = os.listdir(path)
+    METRICS.count("listdir_calls")
+    METRICS.observe("listdir", time.perf_counter() - started)
+    return names
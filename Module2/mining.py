@@ -0,0 +1,163 @@
+"""Proof of work for the blocks of Task2_2: a nonce whose block hash has `difficulty` leading zero bits.
+
+The nonce space is cut into ranges that are searched on a process pool. The
+first worker that finds a nonce sets a shared event, the other workers stop
+at their next check and the ranges that haven't started are cancelled.
+Every `window` blocks the difficulty is moved towards target_interval:
+
+    with Miner(difficulty=18, target_interval=2.0) as miner:
+        bc = Blockchain("blockchain_data", miner=miner)
+        block = bc.create_block("0", 0)
+        print(miner.stats())
+"""
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from hashing import Hasher
+from metrics import METRICS
+
+# the shared event is checked once per CHECK_EVERY nonces
+CHECK_EVERY = 1024
+
+_found = None
+
+
+def meets_difficulty(block_hash, difficulty):
+    return int(block_hash, 16) >> (len(block_hash) * 4 - difficulty) == 0
+
+
+def _init_worker(found):
+    global _found
+    _found = found
+
+
+def _search(prefix, suffix, algorithm, difficulty, start, stop):
+    # the prefix of the block is hashed once, each nonce only costs a copy of that state
+    started = time.perf_counter()
+    base = Hasher(algorithm).new()
+    base.update(prefix)
+    shift = base.digest_size * 8 - difficulty
+    nonce, found = start, None
+    while nonce < stop and found is None:
+        if _found.is_set():
+            break
+        for nonce in range(nonce, min(nonce + CHECK_EVERY, stop)):
+            candidate = base.copy()
+            candidate.update(b"%d%s" % (nonce, suffix))
+            if int.from_bytes(candidate.digest(), "big") >> shift == 0:
+                found = nonce
+                _found.set()
+                break
+        nonce += 1
+    return {"nonce": found, "hashes": nonce - start, "seconds": time.perf_counter() - started, "pid": os.getpid()}
+
+
+class Miner:
+    """Nonce search on a process pool with the difficulty adjusted to a target block interval.
+
+    The pool is started once and reused for every block. Without
+    target_interval the difficulty stays fixed.
+    """
+
+    def __init__(self, difficulty=16, target_interval=None, window=10, workers=None, chunk_size=1 << 16):
+        self.difficulty = difficulty
+        self.target_interval = target_interval
+        self.window = window
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._found = multiprocessing.Event()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self._found,))
+        self._intervals = []
+        self._totals = {"blocks": 0, "hashes": 0, "seconds": 0.0}
+        # pid -> hashes and seconds of the worker, for the hash rate of one core
+        self._per_worker = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def mine(self, block, hasher):
+        """Set block["nonce"], block["difficulty"] and block["block_hash"]; returns the report of the search."""
+        block["difficulty"] = self.difficulty
+        prefix, suffix = self._template(block)
+        self._found.clear()
+
+        started = time.perf_counter()
+        next_start, pending, solution, hashes = 0, set(), None, 0
+        while True:
+            # two ranges per worker, so a worker never waits for the next one
+            while solution is None and len(pending) < self.workers * 2:
+                pending.add(self._executor.submit(_search, prefix, suffix, hasher.algorithm, self.difficulty,
+                                                  next_start, next_start + self.chunk_size))
+                next_start += self.chunk_size
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.cancelled():
+                    continue
+                result = future.result()
+                hashes += result["hashes"]
+                worker = self._per_worker.setdefault(result["pid"], {"hashes": 0, "seconds": 0.0})
+                worker["hashes"] += result["hashes"]
+                worker["seconds"] += result["seconds"]
+                if result["nonce"] is not None and (solution is None or result["nonce"] < solution):
+                    solution = result["nonce"]
+            if solution is not None:
+                for future in pending:
+                    future.cancel()
+        seconds = time.perf_counter() - started
+
+        block["nonce"] = solution
+        block["block_hash"] = hasher.hash_bytes(prefix + str(solution).encode() + suffix)
+        METRICS.count("hashes", hashes)
+        self._totals["blocks"] += 1
+        self._totals["hashes"] += hashes
+        self._totals["seconds"] += seconds
+        report = {"nonce": solution, "difficulty": self.difficulty, "hashes": hashes, "seconds": seconds,
+                  "hash_rate": hashes / seconds if seconds else 0.0}
+        self._adjust(seconds)
+        return report
+
+    @staticmethod
+    def _template(block):
+        # the JSON of _calculate_hash split around the nonce: prefix + str(nonce) + suffix
+        text = json.dumps(dict(block, block_hash="", nonce=0), sort_keys=True)
+        position = text.index('"nonce": 0') + len('"nonce": ')
+        return text[:position].encode(), text[position + 1:].encode()
+
+    def _adjust(self, seconds):
+        if self.target_interval is None:
+            return
+        self._intervals.append(seconds)
+        if len(self._intervals) < self.window:
+            return
+        average = sum(self._intervals) / len(self._intervals)
+        self._intervals = []
+        # one bit of difficulty doubles the expected work, at most two bits per adjustment
+        step = round(math.log2(self.target_interval / average)) if average else 2
+        self.difficulty = max(0, self.difficulty + max(-2, min(2, step)))
+
+    def stats(self):
+        totals = self._totals
+        return {
+            "blocks": totals["blocks"],
+            "difficulty": self.difficulty,
+            "hashes": totals["hashes"],
+            "seconds": totals["seconds"],
+            "hash_rate": totals["hashes"] / totals["seconds"] if totals["seconds"] else 0.0,
+            "workers": {
+                pid: dict(worker, hash_rate=worker["hashes"] / worker["seconds"] if worker["seconds"] else 0.0)
+                for pid, worker in self._per_worker.items()
+            }
+        }
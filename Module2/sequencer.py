@@ -0,0 +1,102 @@
+"""Ordering of appends when several processes write blocks into one directory.
+
+Producers take an exclusive file lock for the short time of an append and
+pick up what the other processes appended before they build a block. The
+block file itself is published with publish(): it only appears when it is
+complete and never replaces an existing block, so a producer that doesn't
+take the lock can't silently fork the chain either.
+"""
+import os
+import re
+import threading
+
+from metrics import listdir, open_file
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+APPEND_RETRIES = 16
+
+_BLOCK_FILE = re.compile(r"block_(\d+)\.json$")
+
+
+class ChainConflictError(RuntimeError):
+    pass
+
+
+class FileLock:
+    """Exclusive lock on a file, shared by the threads of a process and by other processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a+b")
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._thread_lock.release()
+
+    def close(self):
+        self._file.close()
+
+
+def publish(path, data):
+    """Create path with data unless it exists: compare-and-swap on a block height.
+
+    The data goes into a temporary file which is hard-linked to path, so no
+    process sees a half-written block. FileExistsError means that another
+    process has taken the height. On a filesystem without hard links the file
+    is created with open(path, "x"), still exclusive but visible while it is
+    written.
+    """
+    mode = "b" if isinstance(data, bytes) else ""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open_file(tmp_path, "w" + mode) as f:
+        f.write(data)
+    try:
+        os.link(tmp_path, path)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        pass  # no hard links here (e.g. FAT, some network filesystems)
+    finally:
+        os.remove(tmp_path)
+    with open_file(path, "x" + mode) as f:
+        f.write(data)
+
+
+def chain_height(blocks_dir):
+    """Number of blocks block_0.json .. block_N.json without a gap, other files are ignored."""
+    numbers = set()
+    for name in listdir(blocks_dir):
+        match = _BLOCK_FILE.match(name)
+        if match:
+            numbers.add(int(match.group(1)))
+    height = 0
+    while height in numbers:
+        height += 1
+    return height
+
+
+def probe_height(blocks_dir, height):
+    """Height after the blocks appended since height was known (by this or other processes)."""
+    while os.path.exists(os.path.join(blocks_dir, f"block_{height}.json")):
+        height += 1
+    return height
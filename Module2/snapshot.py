@@ -0,0 +1,94 @@
+"""Snapshots of the chain metadata, so a chain is opened without reading its blocks.
+
+A snapshot holds the height, the tip hash, the block_hash of every height
+and the state of the indexes in one file: the sizes of the raw bytes values
+(the hash list, the time index arrays), a JSON header referring to them and
+the values themselves. Loading it
+runs no code from the file, a missing or unreadable snapshot only means a
+slower start.
+"""
+import json
+import os
+import struct
+
+from writer import fsync_path
+
+MAGIC = b"SNAP"
+VERSION = 3
+
+# magic, version, length of the JSON header, number of bytes values
+_HEADER = struct.Struct("<4sIII")
+
+
+class HashList:
+    """block_hash of every height as raw digests in one bytearray (16 bytes per md5 hash)."""
+
+    def __init__(self, data=b"", digest_size=None):
+        self.data = bytearray(data)
+        self.digest_size = digest_size
+
+    def __len__(self):
+        return len(self.data) // self.digest_size if self.digest_size else 0
+
+    def append(self, block_hash):
+        digest = bytes.fromhex(block_hash)
+        if self.digest_size is None:
+            self.digest_size = len(digest)
+        elif len(digest) != self.digest_size:
+            raise ValueError(f"Hash {block_hash} doesn't match the hash size of the chain")
+        self.data += digest
+
+    def __getitem__(self, height):
+        if not 0 <= height < len(self):
+            raise IndexError(f"Block {height} does not exist")
+        return self.data[height * self.digest_size:(height + 1) * self.digest_size].hex()
+
+
+def save_snapshot(path, snapshot):
+    # bytes values are moved out of the JSON header, {"$blob": n} refers to the n-th of them;
+    # the encoder only calls default() for them, the rest of the walk stays in C
+    blobs = []
+
+    def pack(value):
+        if not isinstance(value, (bytes, bytearray)):
+            raise TypeError(f"{type(value).__name__} can't be stored in a snapshot")
+        blobs.append(bytes(value))
+        return {"$blob": len(blobs) - 1}
+
+    header = json.dumps(snapshot, default=pack).encode()
+    sizes = struct.pack(f"<{len(blobs)}Q", *map(len, blobs))
+    # written next to the old snapshot and renamed over it, a crash leaves one of the two
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(header), len(blobs)))
+        f.write(sizes)
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    fsync_path(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, header_size, count = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            return None
+        sizes = struct.unpack_from(f"<{count}Q", data, _HEADER.size)
+        start = _HEADER.size + 8 * count
+        offset = start + header_size
+        blobs = []
+        for size in sizes:
+            blobs.append(data[offset:offset + size])
+            offset += size
+        if offset != len(data):
+            return None
+
+        def unpack(value):
+            return blobs[value["$blob"]] if "$blob" in value else value
+
+        return json.loads(data[start:start + header_size], object_hook=unpack)
+    except (OSError, ValueError, struct.error, KeyError, IndexError, TypeError):
+        return None
@@ -0,0 +1,278 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+
+from block import MAGICS, Block
+from metrics import METRICS, open_file, timed
+from sequencer import chain_height, probe_height, publish
+from writer import fsync_dir, fsync_path
+
+
+class FileStorage:
+    """Legacy layout: every block is stored in its own block_N.json file."""
+
+    def __init__(self, blocks_dir, shared=False):
+        self.blocks_dir = blocks_dir
+        if not os.path.exists(self.blocks_dir):
+            os.mkdir(self.blocks_dir)
+        # shared=True: other processes append too, a block file is published instead of written
+        self.shared = shared
+        self._height = None
+        self._unsynced = []
+
+    def __len__(self):
+        # the directory is listed only once, after that the height is tracked in memory
+        if self._height is None:
+            self._height = chain_height(self.blocks_dir)
+        return self._height
+
+    def resume(self, height):
+        """Continue from a known height (a snapshot, another process appending): only later files are looked up."""
+        if height and not os.path.exists(self.block_path(height - 1)):
+            return
+        self._height = probe_height(self.blocks_dir, height)
+
+    def block_path(self, index):
+        return os.path.join(self.blocks_dir, f"block_{index}.json")
+
+    @timed("storage_append")
+    def append(self, block):
+        index = len(self)
+        data = block.to_dict() if isinstance(block, Block) else block
+        if self.shared:
+            # an existing block is never replaced, FileExistsError means another process wrote this height
+            publish(self.block_path(index), json.dumps(data, indent=4))
+        else:
+            with open_file(self.block_path(index), "w") as f:
+                json.dump(data, f, indent=4)
+        self._unsynced.append(self.block_path(index))
+        self._height = index + 1
+        return index
+
+    @timed("storage_read")
+    def read(self, index):
+        return self.read_sized(index)[0]
+
+    def read_sized(self, index):
+        """The block and the size of its file, for BlockCache."""
+        with open_file(self.block_path(index), "rb") as f:
+            data = f.read()
+        return json.loads(data), len(data)
+
+    def version(self, index):
+        """mtime and size of the block file: a cached copy is stale when they change."""
+        stat = os.stat(self.block_path(index))
+        return stat.st_mtime_ns, stat.st_size
+
+    def tip(self):
+        height = len(self)
+        return self.read(height - 1) if height else None
+
+    def iter_blocks(self, start=0):
+        for index in range(start, len(self)):
+            yield self.read(index)
+
+    def fingerprint(self, height):
+        """Cheap summary of the blocks below height, it changes when any of their files is rewritten.
+
+        One scandir pass over the directory: the CRC of the mtime and size of
+        every block file below height, in height order. No block is read or
+        parsed.
+        """
+        if not height:
+            return []
+        # (mtime, size) of every height, zeros for a missing file
+        records = array("q", bytes(16 * height))
+        count = 0
+        with os.scandir(self.blocks_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name[:6] != "block_" or name[-5:] != ".json" or not name[6:-5].isdigit():
+                    continue
+                index = int(name[6:-5])
+                if index < height:
+                    stat = entry.stat()
+                    records[2 * index], records[2 * index + 1] = stat.st_mtime_ns, stat.st_size
+                    count += 1
+        return [count, zlib.crc32(records)]
+
+    def sync(self):
+        for path in self._unsynced:
+            fsync_path(path)
+        if self._unsynced:
+            fsync_dir(self.blocks_dir)
+        self._unsynced = []
+
+    def close(self):
+        pass
+
+
+class SegmentStorage:
+    """Append-only storage: blocks are appended to rolling segment files.
+
+    segment_N.log  - blocks as compact JSON or the binary Block encoding, separated by newlines
+    index.bin      - one fixed-size (segment, offset, length) record per block
+    tip.bin        - height of the chain and hash of the last block
+    """
+
+    INDEX_RECORD = struct.Struct("<IQI")
+    TIP_RECORD = struct.Struct("<Q128s")
+
+    def __init__(self, blocks_dir, segment_size=64 * 1024 * 1024):
+        self.blocks_dir = blocks_dir
+        self.segment_size = segment_size
+        if not os.path.exists(self.blocks_dir):
+            os.mkdir(self.blocks_dir)
+
+        self._maps = {}
+        # appends may come from a background writer thread while other threads read
+        self._lock = threading.Lock()
+        self._tip_file = self._open(os.path.join(self.blocks_dir, "tip.bin"))
+        self._index_file = self._open(os.path.join(self.blocks_dir, "index.bin"))
+        self._height, self._tip_hash = self._read_tip()
+
+        # Everything after the tip pointer belongs to an interrupted append
+        self._index_file.truncate(self._height * self.INDEX_RECORD.size)
+        if self._height:
+            segment, offset, length = self._read_index(self._height - 1)
+            self._segment, self._segment_end = segment, offset + length + 1
+        else:
+            self._segment, self._segment_end = 0, 0
+        self._segment_file = self._open(self._segment_path(self._segment))
+        self._segment_file.truncate(self._segment_end)
+        self._segment_file.seek(self._segment_end)
+
+    @staticmethod
+    def _open(path):
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        return open(path, "r+b")
+
+    def _segment_path(self, segment):
+        return os.path.join(self.blocks_dir, f"segment_{segment:05d}.log")
+
+    def _read_tip(self):
+        self._tip_file.seek(0)
+        data = self._tip_file.read(self.TIP_RECORD.size)
+        if len(data) < self.TIP_RECORD.size:
+            return 0, ""
+        height, tip_hash = self.TIP_RECORD.unpack(data)
+        return height, tip_hash.rstrip(b"\0").decode()
+
+    def _read_index(self, index):
+        with self._lock:
+            self._index_file.seek(index * self.INDEX_RECORD.size)
+            return self.INDEX_RECORD.unpack(self._index_file.read(self.INDEX_RECORD.size))
+
+    def _segment_map(self, segment, end):
+        mapped = self._maps.get(segment)
+        # the active segment keeps growing, so its map is refreshed when a read goes past it
+        if mapped is None or len(mapped) < end:
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(segment), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapped
+        return mapped
+
+    def __len__(self):
+        return self._height
+
+    @property
+    def tip_hash(self):
+        return self._tip_hash
+
+    @timed("storage_append")
+    def append(self, block):
+        if isinstance(block, Block):
+            data = block.encode()
+        else:
+            data = json.dumps(block, separators=(",", ":")).encode()
+        with self._lock:
+            return self._append(block, data)
+
+    def _append(self, block, data):
+        if self._segment_end and self._segment_end + len(data) + 1 > self.segment_size:
+            # a sealed segment is never written again, so it is synced once here
+            os.fsync(self._segment_file.fileno())
+            self._segment_file.close()
+            self._segment += 1
+            self._segment_end = 0
+            self._segment_file = self._open(self._segment_path(self._segment))
+
+        offset = self._segment_end
+        if METRICS.enabled:
+            METRICS.count("bytes_written", len(data) + 1)
+        self._segment_file.write(data + b"\n")
+        self._segment_file.flush()
+        self._segment_end += len(data) + 1
+
+        index = self._height
+        self._index_file.seek(index * self.INDEX_RECORD.size)
+        self._index_file.write(self.INDEX_RECORD.pack(self._segment, offset, len(data)))
+        self._index_file.flush()
+
+        # The tip pointer is written last: a block is part of the chain only after this step
+        tip_hash = block.get("block_hash", "")
+        self._tip_file.seek(0)
+        self._tip_file.write(self.TIP_RECORD.pack(index + 1, tip_hash.encode()))
+        self._tip_file.flush()
+
+        self._height, self._tip_hash = index + 1, tip_hash
+        return index
+
+    @timed("storage_read")
+    def read(self, index):
+        return self.read_sized(index)[0]
+
+    def read_sized(self, index):
+        """The block and the size of its record, for BlockCache."""
+        if not 0 <= index < self._height:
+            raise IndexError(f"Block {index} does not exist")
+        segment, offset, length = self._read_index(index)
+        if METRICS.enabled:
+            METRICS.count("bytes_read", length)
+        data = self._segment_map(segment, offset + length)[offset:offset + length]
+        return (Block.decode(data) if data.startswith(MAGICS) else json.loads(data)), length
+
+    def version(self, index):
+        # records are never rewritten, a cached block stays valid
+        return None
+
+    def tip(self):
+        return self.read(self._height - 1) if self._height else None
+
+    def iter_blocks(self, start=0):
+        for index in range(start, self._height):
+            yield self.read(index)
+
+    def fingerprint(self, height):
+        """Cheap summary of the blocks below height, it changes when any of their bytes is rewritten"""
+        if not height:
+            return []
+        segment, offset, length = self._read_index(height - 1)
+        # sealed segments are never appended to again, so their size and mtime are enough
+        result = []
+        for sealed in range(segment):
+            stat = os.stat(self._segment_path(sealed))
+            result.append([stat.st_size, stat.st_mtime_ns])
+        with memoryview(self._segment_map(segment, offset + length)) as view:
+            result.append(zlib.crc32(view[:offset + length]))
+        return result
+
+    def sync(self):
+        with self._lock:
+            for f in (self._segment_file, self._index_file, self._tip_file):
+                os.fsync(f.fileno())
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+        self._segment_file.close()
+        self._index_file.close()
+        self._tip_file.close()
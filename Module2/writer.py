@@ -0,0 +1,154 @@
+import atexit
+import json
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from metrics import open_file
+from sequencer import publish
+
+DURABILITY_LEVELS = ("none", "batch", "block")
+
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path):
+    # new file names are durable only after their directory is synced (not possible on Windows)
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BlockWriter:
+    """Background writer thread with a bounded queue and group commit.
+
+    Every submitted write returns a Future which is resolved when the write is
+    durable for the chosen level: "none" - written to the OS, "batch" - one
+    fsync for the whole batch taken from the queue, "block" - fsync per write.
+    """
+
+    def __init__(self, durability="batch", sync=None, max_queue=1024, max_batch=256):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability must be one of {DURABILITY_LEVELS}")
+        self.durability = durability
+        self.max_batch = max_batch
+        self._sync_callback = sync
+        self._queue = queue.Queue(max_queue)
+        self._dirty_paths = set()
+        self._pending_paths = {}
+        self._lock = threading.Lock()
+        # writes submitted and not resolved yet, flush() of an idle writer returns at once
+        self._pending = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="block-writer", daemon=True)
+        self._thread.start()
+        # the thread is a daemon, so the queued blocks are written out when the interpreter exits
+        atexit.register(self.close)
+
+    def submit(self, func, *args):
+        future = Future()
+        with self._lock:
+            self._pending += 1
+        self._queue.put((future, func, args))
+        return future
+
+    def write_json(self, data, path, indent=None, exclusive=False):
+        future = self.submit(self._write_json, data, path, indent, exclusive)
+        with self._lock:
+            self._pending_paths[path] = future
+        future.add_done_callback(lambda done: self._forget(path, done))
+        return future
+
+    def _forget(self, path, future):
+        with self._lock:
+            if self._pending_paths.get(path) is future:
+                del self._pending_paths[path]
+
+    def _write_json(self, data, path, indent, exclusive):
+        # exclusive: the file is created only if it doesn't exist, see sequencer.publish
+        if exclusive:
+            publish(path, json.dumps(data, indent=indent))
+        else:
+            with open_file(path, "w") as f:
+                json.dump(data, f, indent=indent)
+        self._dirty_paths.add(path)
+
+    def wait(self, path):
+        """Wait until a pending write of the file is durable."""
+        with self._lock:
+            future = self._pending_paths.get(path)
+        if future is not None:
+            future.result()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+        self.submit(lambda: None).result()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _sync(self):
+        for path in self._dirty_paths:
+            fsync_path(path)
+        for directory in {os.path.dirname(path) or "." for path in self._dirty_paths}:
+            fsync_dir(directory)
+        self._dirty_paths.clear()
+        if self._sync_callback is not None:
+            self._sync_callback()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            # group commit: everything that is already waiting goes into the same batch
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)
+                    break
+                batch.append(job)
+
+            done = []
+            for future, func, args in batch:
+                try:
+                    result = func(*args)
+                    if self.durability == "block":
+                        self._sync()
+                    done.append((future, result))
+                except Exception as e:
+                    future.set_exception(e)
+            try:
+                if self.durability == "batch":
+                    self._sync()
+            except Exception as e:
+                for future, _ in done:
+                    future.set_exception(e)
+            else:
+                for future, result in done:
+                    future.set_result(result)
+            with self._lock:
+                self._pending -= len(batch)
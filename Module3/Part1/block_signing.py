@@ -0,0 +1,91 @@
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import functools
+import os
+import time
+
+
+class BlockSigner:
+    """Signs the block_hash of every produced block with one Ed25519 key.
+
+    Can be passed as Blockchain(signer=...) in Module2/Task2_1.py.
+    """
+
+    def __init__(self, private_key):
+        self.private_key = private_key
+        self.public_key_hex = private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        ).hex()
+
+    def sign_block(self, block):
+        block["signer"] = self.public_key_hex
+        block["signature"] = self.private_key.sign(block["block_hash"].encode()).hex()
+        return block
+
+
+# every worker keeps the parsed keys of the signers it has already seen
+@functools.lru_cache(maxsize=4096)
+def _public_key(signer_hex):
+    return ed25519.Ed25519PublicKey.from_public_bytes(bytes.fromhex(signer_hex))
+
+
+def verify_signature(signer_hex, signature_hex, block_hash):
+    if not signer_hex or not signature_hex:
+        return False
+    try:
+        _public_key(signer_hex).verify(bytes.fromhex(signature_hex), block_hash.encode())
+        return True
+    except (InvalidSignature, ValueError):
+        return False
+
+
+def _verify_batch(items):
+    return [verify_signature(*item) for item in items]
+
+
+def _batches(blocks, batch_size):
+    batch = []
+    for block in blocks:
+        batch.append((block.get("signer"), block.get("signature"), block["block_hash"]))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def verify_blocks(blocks, workers=None, batch_size=2048):
+    """Checks the signatures of the blocks on a process pool.
+
+    Returns one True/False per block in the order of the blocks, an invalid or
+    missing signature doesn't stop the check. Only a few batches are in
+    flight at a time, so the blocks can come from a generator over the disk.
+    """
+    workers = workers or os.cpu_count() or 1
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for batch in _batches(blocks, batch_size):
+            in_flight.append(executor.submit(_verify_batch, batch))
+            if len(in_flight) >= workers * 2:
+                results.extend(in_flight.popleft().result())
+        while in_flight:
+            results.extend(in_flight.popleft().result())
+    return results
+
+
+def audit_signatures(blocks, workers=None, batch_size=2048):
+    """verify_blocks with a report: numbers of the failed blocks and throughput."""
+    started = time.perf_counter()
+    results = verify_blocks(blocks, workers, batch_size)
+    seconds = time.perf_counter() - started
+    return {
+        "checked": len(results),
+        "failed": [number for number, ok in enumerate(results) if not ok],
+        "seconds": seconds,
+        "blocks_per_sec": len(results) / seconds if seconds else 0.0
+    }
@@ -0,0 +1,178 @@
+"""Batch generation of keys and CSRs (Task 5 of Task3_1.py) for many subjects.
+
+Subjects come from a CSV file with a header or from JSON lines with the keys
+of NAME_FIELDS. Keys and CSRs are made on a process pool, optionally signed
+by the intermediate CA of Module3/Part2/Task3_2.py, and streamed into one PEM
+bundle in the order of the subjects; only a few batches are in memory at a time:
+
+    python csr_pipeline.py nodes.csv nodes_bundle.pem --sign
+"""
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from cryptography.hazmat.primitives import serialization
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import argparse
+import csv
+import functools
+import json
+import os
+import sys
+import time
+
+# build_final_certificate of the intermediate CA lives in Module3/Part2
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Part2"))
+
+from Task3_2 import build_final_certificate
+
+NAME_FIELDS = {
+    "country": NameOID.COUNTRY_NAME,
+    "state": NameOID.STATE_OR_PROVINCE_NAME,
+    "locality": NameOID.LOCALITY_NAME,
+    "organization": NameOID.ORGANIZATION_NAME,
+    "common_name": NameOID.COMMON_NAME,
+}
+
+FORMATS = ("csv", "jsonl")
+
+
+def read_subjects(stream, fmt="csv"):
+    """Yield the subjects of a text stream as dicts of NAME_FIELDS."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    rows = csv.DictReader(stream) if fmt == "csv" else (json.loads(line) for line in stream if line.strip())
+    for row in rows:
+        unknown = set(row) - set(NAME_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown subject fields: {sorted(unknown)}")
+        yield {field: value for field, value in row.items() if value}
+
+
+def subject_name(row):
+    return x509.Name([x509.NameAttribute(NAME_FIELDS[field], value)
+                      for field, value in row.items()])
+
+
+# every worker parses the CA key and certificate once
+@functools.lru_cache(maxsize=4)
+def _load_issuer(issuer_key_pem, issuer_cert_pem):
+    return (serialization.load_pem_private_key(issuer_key_pem, password=None),
+            x509.load_pem_x509_certificate(issuer_cert_pem))
+
+
+def _make_batch(rows, issuer, days, password):
+    encryption = serialization.BestAvailableEncryption(password) if password else serialization.NoEncryption()
+    results = []
+    for row in rows:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        csr = x509.CertificateSigningRequestBuilder().subject_name(subject_name(row)).sign(
+            private_key, algorithm=None
+        )
+        entry = private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=encryption
+        ) + csr.public_bytes(serialization.Encoding.PEM)
+        if issuer:
+            issuer_key, issuer_cert = _load_issuer(*issuer)
+            certificate = build_final_certificate(csr.subject, csr.public_key(), issuer_key, issuer_cert,
+                                                  x509.random_serial_number(), days)
+            entry += certificate.public_bytes(serialization.Encoding.PEM)
+        results.append(entry)
+    return results
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_pipeline(subjects, bundle, issuer_key=None, issuer_cert=None, days=10, password=None,
+                 workers=None, batch_size=256, progress=None):
+    """Write key + CSR (+ certificate, when an issuer is given) of every subject into bundle.
+
+    bundle is a binary file object, progress is called with the number of
+    processed subjects and the rate after every batch.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    issuer = None
+    if issuer_key is not None:
+        issuer = (issuer_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        ), issuer_cert.public_bytes(serialization.Encoding.PEM))
+
+    processed = 0
+
+    def write(entries):
+        nonlocal processed
+        bundle.writelines(entries)
+        processed += len(entries)
+        if progress:
+            progress(processed, processed / (time.perf_counter() - started))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for batch in _batches(subjects, batch_size):
+            in_flight.append(executor.submit(_make_batch, batch, issuer, days, password))
+            if len(in_flight) >= workers * 2:
+                write(in_flight.popleft().result())
+        while in_flight:
+            write(in_flight.popleft().result())
+    bundle.flush()
+
+    seconds = time.perf_counter() - started
+    return {
+        "processed": processed,
+        "signed": issuer is not None,
+        "seconds": seconds,
+        "per_sec": processed / seconds if seconds else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch key/CSR generation")
+    parser.add_argument("subjects", help="CSV or JSON lines file, - for stdin")
+    parser.add_argument("bundle", help="output PEM bundle, - for stdout")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--sign", action="store_true", help="sign the CSRs with the intermediate CA")
+    parser.add_argument("--ca-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Part2"))
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--password", help="encrypt the generated private keys")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    issuer_key = issuer_cert = None
+    if args.sign:
+        with open(os.path.join(args.ca_dir, "intermediate_private_key.pem"), "rb") as f:
+            issuer_key = serialization.load_pem_private_key(f.read(), password=None)
+        with open(os.path.join(args.ca_dir, "intermediate_certificate.pem"), "rb") as f:
+            issuer_cert = x509.load_pem_x509_certificate(f.read())
+
+    source = sys.stdin if args.subjects == "-" else open(args.subjects, newline="", encoding="utf-8")
+    bundle = sys.stdout.buffer if args.bundle == "-" else open(args.bundle, "wb")
+
+    # progress goes to stderr, stdout may be the bundle itself
+    def progress(count, rate):
+        print(f"\r{count} subjects, {rate:.0f}/s", end="", file=sys.stderr)
+
+    with source, bundle:
+        report = run_pipeline(read_subjects(source, args.format), bundle, issuer_key, issuer_cert, args.days,
+                              args.password.encode() if args.password else None, args.workers,
+                              args.batch_size, progress)
+    print(f"\nDone: {report['processed']} subjects in {report['seconds']:.2f} s "
+          f"({report['per_sec']:.0f}/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
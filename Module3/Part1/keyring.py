@@ -0,0 +1,136 @@
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+from block_signing import BlockSigner
+
+ENCODINGS = {"pem": serialization.Encoding.PEM, "der": serialization.Encoding.DER}
+
+
+def key_id(public_key):
+    """SHA-256 fingerprint of the SubjectPublicKeyInfo of the key."""
+    return hashlib.sha256(public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )).hexdigest()
+
+
+class Keyring:
+    """Keys stored in one directory, each decrypted and parsed only once.
+
+    Parsed key objects are kept in an LRU cache keyed by key id, so signing and
+    verification on a hot path cost a dict lookup instead of reading the file
+    and running the (deliberately slow) KDF of BestAvailableEncryption.
+    Keys are written as <key id>.key.pem / .pub.pem or, with encoding="der",
+    in the more compact DER form; both forms are read.
+    """
+
+    def __init__(self, keys_dir="keys", password=None, encoding="pem", cache_size=128):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"encoding must be one of {tuple(ENCODINGS)}")
+        self.keys_dir = keys_dir
+        self.password = password
+        self.encoding = encoding
+        self.cache_size = cache_size
+        self.stats = {"hits": 0, "misses": 0}
+        self._private = OrderedDict()
+        self._public = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(keys_dir, exist_ok=True)
+
+    def _path(self, kid, kind, encoding):
+        return os.path.join(self.keys_dir, f"{kid}.{kind}.{encoding}")
+
+    def add(self, private_key):
+        """Store a private key and its public key, returns the key id."""
+        kid = key_id(private_key.public_key())
+        encryption = (serialization.BestAvailableEncryption(self.password) if self.password
+                      else serialization.NoEncryption())
+        with open(self._path(kid, "key", self.encoding), "wb") as f:
+            f.write(private_key.private_bytes(
+                encoding=ENCODINGS[self.encoding],
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=encryption
+            ))
+        with open(self._path(kid, "pub", self.encoding), "wb") as f:
+            f.write(private_key.public_key().public_bytes(
+                encoding=ENCODINGS[self.encoding],
+                format=serialization.PublicFormat.SubjectPublicKeyInfo
+            ))
+        with self._lock:
+            self._remember(self._private, kid, private_key)
+        return kid
+
+    def import_pem(self, path, password=None):
+        """Add a key from a PEM file, like private_key.pem of Task3_1.py."""
+        with open(path, "rb") as f:
+            return self.add(serialization.load_pem_private_key(f.read(), password=password))
+
+    def key_ids(self):
+        return sorted({name.split(".")[0] for name in os.listdir(self.keys_dir) if ".pub." in name})
+
+    def _remember(self, cache, kid, key):
+        cache[kid] = key
+        cache.move_to_end(kid)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _cached(self, cache, kid, load):
+        with self._lock:
+            key = cache.get(kid)
+            if key is not None:
+                cache.move_to_end(kid)
+                self.stats["hits"] += 1
+                return key
+            self.stats["misses"] += 1
+        # the file is parsed outside the lock, a slow KDF doesn't block the other keys
+        key = load(kid)
+        with self._lock:
+            self._remember(cache, kid, key)
+        return key
+
+    def _read(self, kid, kind):
+        for encoding in (self.encoding, "der" if self.encoding == "pem" else "pem"):
+            path = self._path(kid, kind, encoding)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return encoding, f.read()
+        raise KeyError(f"Key {kid} is not in the keyring")
+
+    def _load_private(self, kid):
+        encoding, data = self._read(kid, "key")
+        load = serialization.load_der_private_key if encoding == "der" else serialization.load_pem_private_key
+        return load(data, password=self.password)
+
+    def _load_public(self, kid):
+        with self._lock:
+            private_key = self._private.get(kid)
+        if private_key is not None:
+            return private_key.public_key()
+        encoding, data = self._read(kid, "pub")
+        load = serialization.load_der_public_key if encoding == "der" else serialization.load_pem_public_key
+        return load(data)
+
+    def private_key(self, kid):
+        return self._cached(self._private, kid, self._load_private)
+
+    def public_key(self, kid):
+        return self._cached(self._public, kid, self._load_public)
+
+    def sign(self, kid, data):
+        # Ed25519 keys like the ones of Task3_1.py, other key types also need a padding/algorithm
+        return self.private_key(kid).sign(data)
+
+    def verify(self, kid, signature, data):
+        try:
+            self.public_key(kid).verify(signature, data)
+            return True
+        except InvalidSignature:
+            return False
+
+    def block_signer(self, kid):
+        """BlockSigner for Blockchain(signer=...) of Module2/Task2_1.py."""
+        return BlockSigner(self.private_key(kid))
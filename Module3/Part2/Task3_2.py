@@ -5,6 +5,9 @@ from cryptography.x509.oid import NameOID
 import datetime
 import random
 
+from chain_verifier import CertificateChainVerifier
+from revocation import RevocationChecker, generate_crl, save_crl
+
 
 def generate_base_certificate():
     """Создает базовый (самоподписанный) сертификат."""
@@ -115,27 +118,16 @@ def generate_intermediate_certificate(base_key, base_cert):
     return private_key, certificate
 
 
-def generate_final_certificate(intermediate_key, intermediate_cert):
-    """Создает конечный сертификат, подписанный промежуточным."""
-    private_key = ec.generate_private_key(ec.SECP256R1())
-    public_key = private_key.public_key()
-
-    subject = x509.Name([
-        x509.NameAttribute(NameOID.COUNTRY_NAME, "RU"),
-        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Санкт-Петербург"),
-        x509.NameAttribute(NameOID.LOCALITY_NAME, "Санкт-Петербург"),
-        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Final User"),
-        x509.NameAttribute(NameOID.COMMON_NAME, "finaluser.example.com"),
-    ])
-
-    certificate = (
+def build_final_certificate(subject, public_key, intermediate_key, intermediate_cert, serial_number, days=10):
+    """Подписывает конечный сертификат промежуточным ключом, без записи на диск."""
+    return (
         x509.CertificateBuilder()
         .subject_name(subject)
         .issuer_name(intermediate_cert.subject)
         .public_key(public_key)
-        .serial_number(random.randint(1, 2**64))
+        .serial_number(serial_number)
         .not_valid_before(datetime.datetime.now(datetime.UTC))
-        .not_valid_after(datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=10))
+        .not_valid_after(datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=days))
         .add_extension(
             x509.BasicConstraints(ca=False, path_length=None), critical=True
         )
@@ -156,6 +148,23 @@ def generate_final_certificate(intermediate_key, intermediate_cert):
         .sign(intermediate_key, hashes.SHA256())
     )
 
+
+def generate_final_certificate(intermediate_key, intermediate_cert):
+    """Создает конечный сертификат, подписанный промежуточным."""
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    public_key = private_key.public_key()
+
+    subject = x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, "RU"),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Санкт-Петербург"),
+        x509.NameAttribute(NameOID.LOCALITY_NAME, "Санкт-Петербург"),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Final User"),
+        x509.NameAttribute(NameOID.COMMON_NAME, "finaluser.example.com"),
+    ])
+
+    certificate = build_final_certificate(subject, public_key, intermediate_key, intermediate_cert,
+                                          random.randint(1, 2**64))
+
     with open("Module3/Part2/final_private_key.pem", "wb") as f:
         f.write(private_key.private_bytes(
             encoding=serialization.Encoding.PEM,
@@ -175,6 +184,16 @@ def main():
     final_key, final_cert = generate_final_certificate(intermediate_key, intermediate_cert)
     print("Сертификаты успешно созданы!")
 
+    revocation = RevocationChecker()
+    for key, cert, name in ((base_key, base_cert, "base"), (intermediate_key, intermediate_cert, "intermediate")):
+        path = f"Module3/Part2/{name}_crl.pem"
+        save_crl(generate_crl(key, cert, [], crl_number=1), path)
+        revocation.load_file(path, cert)
+
+    verifier = CertificateChainVerifier([base_cert], revocation=revocation)
+    verifier.verify(final_cert, [intermediate_cert])
+    print("Цепочка сертификатов проверена!")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,135 @@
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives import serialization
+from cryptography import x509
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import functools
+import os
+import time
+
+from Task3_2 import build_final_certificate
+
+
+def _generate_keys(count):
+    # ключи не сериализуются pickle, между процессами передается DER
+    return [ec.generate_private_key(ec.SECP256R1()).private_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    ) for _ in range(count)]
+
+
+class KeyPool:
+    """Пул заранее сгенерированных EC-ключей (PKCS8 DER).
+
+    Ключи генерируются пачками в отдельных процессах, пока вызывающий код
+    подписывает сертификаты; в работе всегда держится prefetch пачек.
+    """
+
+    def __init__(self, workers=None, batch_size=256, prefetch=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.prefetch = prefetch or self.workers * 2
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._pending = deque()
+        self._ready = deque()
+        self._fill()
+
+    def _fill(self):
+        while len(self._pending) < self.prefetch:
+            self._pending.append(self._executor.submit(_generate_keys, self.batch_size))
+
+    def take(self, count):
+        """Возвращает count ключей, при необходимости дожидаясь фоновой генерации."""
+        while len(self._ready) < count:
+            self._ready.extend(self._pending.popleft().result())
+            self._fill()
+        return [self._ready.popleft() for _ in range(count)]
+
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# каждый процесс разбирает ключ и сертификат CA один раз
+@functools.lru_cache(maxsize=4)
+def _load_issuer(issuer_key_der, issuer_cert_der):
+    return (serialization.load_der_private_key(issuer_key_der, password=None),
+            x509.load_der_x509_certificate(issuer_cert_der))
+
+
+def _sign_batch(issuer_key_der, issuer_cert_der, items, days):
+    issuer_key, issuer_cert = _load_issuer(issuer_key_der, issuer_cert_der)
+    results = []
+    for subject, key_der in items:
+        private_key = serialization.load_der_private_key(key_der, password=None)
+        # random_serial_number берет байты из os.urandom, у копий процесса после fork серийники не совпадут
+        certificate = build_final_certificate(x509.Name.from_rfc4514_string(subject), private_key.public_key(),
+                                              issuer_key, issuer_cert, x509.random_serial_number(), days)
+        results.append(certificate.public_bytes(serialization.Encoding.PEM) + private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        ))
+    return results
+
+
+def _subject_string(subject):
+    return subject.rfc4514_string() if isinstance(subject, x509.Name) else subject
+
+
+def issue_certificates(subjects, issuer_key, issuer_cert, bundle_path, days=10, workers=None,
+                       batch_size=256, key_pool=None):
+    """Выпускает конечные сертификаты для списка субъектов.
+
+    subjects - объекты x509.Name или строки RFC 4514. Сертификат и ключ
+    каждого субъекта дописываются в один PEM-файл bundle_path в порядке
+    субъектов. Возвращает отчет с количеством и скоростью выпуска.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    issuer_key_der = issuer_key.private_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    issuer_cert_der = issuer_cert.public_bytes(serialization.Encoding.DER)
+    subjects = [_subject_string(subject) for subject in subjects]
+
+    own_pool = key_pool is None
+    key_pool = key_pool or KeyPool(workers, batch_size)
+    issued = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor, open(bundle_path, "wb") as bundle:
+            in_flight = deque()
+            for start in range(0, len(subjects), batch_size):
+                batch = subjects[start:start + batch_size]
+                items = list(zip(batch, key_pool.take(len(batch))))
+                in_flight.append(executor.submit(_sign_batch, issuer_key_der, issuer_cert_der, items, days))
+                if len(in_flight) >= workers * 2:
+                    issued += _write_batch(bundle, in_flight.popleft().result())
+            while in_flight:
+                issued += _write_batch(bundle, in_flight.popleft().result())
+    finally:
+        if own_pool:
+            key_pool.close()
+
+    seconds = time.perf_counter() - started
+    return {
+        "issued": issued,
+        "bundle": bundle_path,
+        "seconds": seconds,
+        "certs_per_sec": issued / seconds if seconds else 0.0
+    }
+
+
+def _write_batch(bundle, entries):
+    bundle.writelines(entries)
+    return len(entries)
@@ -0,0 +1,117 @@
+from cryptography.exceptions import InvalidSignature
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from collections import OrderedDict
+import datetime
+
+from revocation import REVOKED
+
+
+class CertificateVerificationError(Exception):
+    pass
+
+
+def load_certificate(path):
+    with open(path, "rb") as f:
+        return x509.load_pem_x509_certificate(f.read())
+
+
+def fingerprint(certificate):
+    return certificate.fingerprint(hashes.SHA256())
+
+
+def _extension(certificate, extension_type):
+    try:
+        return certificate.extensions.get_extension_for_class(extension_type).value
+    except x509.ExtensionNotFound:
+        return None
+
+
+class CertificateChainVerifier:
+    """Проверяет цепочки сертификатов до доверенных корневых.
+
+    Проверенные связи (отпечаток издателя, отпечаток субъекта) кэшируются до
+    истечения срока действия любого из двух сертификатов, поэтому повторная
+    проверка листового сертификата под известным промежуточным стоит поиска
+    в словаре и не больше одной проверки подписи.
+    """
+
+    def __init__(self, trusted_roots, max_cache_size=10000, revocation=None):
+        self.trusted_roots = {fingerprint(root): root for root in trusted_roots}
+        self.max_cache_size = max_cache_size
+        # RevocationChecker; отзыв проверяется при каждом вызове, связи кэшируются без него
+        self.revocation = revocation
+        self.stats = {"hits": 0, "misses": 0}
+        # (издатель, субъект) -> (not_valid_before, not_valid_after) связи
+        self._links = OrderedDict()
+
+    def verify(self, leaf, intermediates=(), now=None):
+        """Возвращает цепочку [лист, ..., корень] или выбрасывает CertificateVerificationError."""
+        now = now or datetime.datetime.now(datetime.UTC)
+        chain = self._build_chain(leaf, intermediates)
+
+        for position, certificate in enumerate(chain):
+            if not certificate.not_valid_before_utc <= now <= certificate.not_valid_after_utc:
+                raise CertificateVerificationError(f"Сертификат {certificate.subject.rfc4514_string()} "
+                                                   f"недействителен в момент {now}")
+            if position == 0:
+                continue
+            # position - 1 промежуточных CA ниже этого издателя
+            constraints = _extension(certificate, x509.BasicConstraints)
+            if constraints is None:
+                raise CertificateVerificationError(f"{certificate.subject.rfc4514_string()} не является CA")
+            if constraints.path_length is not None and position - 1 > constraints.path_length:
+                raise CertificateVerificationError(f"Превышена длина пути для "
+                                                   f"{certificate.subject.rfc4514_string()}")
+
+        for subject, issuer in zip(chain, chain[1:]):
+            self._verify_link(issuer, subject, now)
+            if self.revocation is not None and self.revocation.check(subject, now) == REVOKED:
+                raise CertificateVerificationError(f"Сертификат {subject.subject.rfc4514_string()} отозван")
+        return chain
+
+    def _build_chain(self, leaf, intermediates):
+        by_subject = {certificate.subject: certificate for certificate in intermediates}
+        roots_by_subject = {root.subject: root for root in self.trusted_roots.values()}
+        chain = [leaf]
+        while fingerprint(chain[-1]) not in self.trusted_roots:
+            issuer = roots_by_subject.get(chain[-1].issuer) or by_subject.get(chain[-1].issuer)
+            if issuer is None or issuer in chain:
+                raise CertificateVerificationError(f"Не найден издатель для "
+                                                   f"{chain[-1].subject.rfc4514_string()}")
+            chain.append(issuer)
+        return chain
+
+    def _verify_link(self, issuer, subject, now):
+        key = (fingerprint(issuer), fingerprint(subject))
+        window = self._links.get(key)
+        if window is not None:
+            if window[0] <= now <= window[1]:
+                self._links.move_to_end(key)
+                self.stats["hits"] += 1
+                return
+            del self._links[key]
+
+        self.stats["misses"] += 1
+        constraints = _extension(issuer, x509.BasicConstraints)
+        if constraints is None or not constraints.ca:
+            raise CertificateVerificationError(f"{issuer.subject.rfc4514_string()} не является CA")
+        usage = _extension(issuer, x509.KeyUsage)
+        if usage is not None and not usage.key_cert_sign:
+            raise CertificateVerificationError(f"{issuer.subject.rfc4514_string()} не может подписывать сертификаты")
+        try:
+            subject.verify_directly_issued_by(issuer)
+        except (InvalidSignature, ValueError, TypeError) as e:
+            raise CertificateVerificationError(f"Неверная подпись {subject.subject.rfc4514_string()}") from e
+
+        self._links[key] = (max(issuer.not_valid_before_utc, subject.not_valid_before_utc),
+                            min(issuer.not_valid_after_utc, subject.not_valid_after_utc))
+        if len(self._links) > self.max_cache_size:
+            self._evict(now)
+
+    def _evict(self, now):
+        # сначала удаляются истекшие связи, затем самые давно использованные
+        for key in [key for key, window in self._links.items() if window[1] < now]:
+            del self._links[key]
+        while len(self._links) > self.max_cache_size:
+            self._links.popitem(last=False)
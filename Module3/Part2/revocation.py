@@ -0,0 +1,133 @@
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization, hashes
+import datetime
+import os
+
+GOOD = "good"
+REVOKED = "revoked"
+UNKNOWN = "unknown"
+
+
+def generate_crl(issuer_key, issuer_cert, revoked, crl_number, days=7, base_crl_number=None):
+    """Создает CRL, подписанный ключом CA.
+
+    revoked - кортежи (серийный номер, дата отзыва[, причина]). С base_crl_number
+    создается delta-CRL: только изменения относительно полного CRL с этим
+    номером, снятие отзыва - причина ReasonFlags.remove_from_crl.
+    """
+    now = datetime.datetime.now(datetime.UTC)
+    builder = (
+        x509.CertificateRevocationListBuilder()
+        .issuer_name(issuer_cert.subject)
+        .last_update(now)
+        .next_update(now + datetime.timedelta(days=days))
+        .add_extension(x509.CRLNumber(crl_number), critical=False)
+    )
+    if base_crl_number is not None:
+        builder = builder.add_extension(x509.DeltaCRLIndicator(base_crl_number), critical=True)
+    for serial_number, revocation_date, *reason in revoked:
+        entry = x509.RevokedCertificateBuilder().serial_number(serial_number).revocation_date(revocation_date)
+        if reason:
+            entry = entry.add_extension(x509.CRLReason(reason[0]), critical=False)
+        builder = builder.add_revoked_certificate(entry.build())
+    return builder.sign(issuer_key, hashes.SHA256())
+
+
+def save_crl(crl, path):
+    with open(path, "wb") as f:
+        f.write(crl.public_bytes(serialization.Encoding.PEM))
+
+
+def _extension(value, extension_type):
+    # value - CRL или сертификат
+    try:
+        return value.extensions.get_extension_for_class(extension_type).value
+    except x509.ExtensionNotFound:
+        return None
+
+
+class RevocationChecker:
+    """Проверка отзыва по CRL: для каждого издателя - множество отозванных серийных номеров.
+
+    Новый полный CRL заменяет множество, delta-CRL применяется к нему на месте;
+    CRL со старым номером пропускается. Файл, не изменившийся с прошлой
+    загрузки, повторно не разбирается.
+    """
+
+    def __init__(self):
+        # имя издателя -> {"number", "base_number", "next_update", "serials"}
+        self._issuers = {}
+        # путь -> (mtime, размер) последнего загруженного файла
+        self._files = {}
+
+    def load_crl(self, crl, issuer_cert):
+        """Загружает CRL издателя issuer_cert, возвращает False для устаревшего CRL."""
+        if crl.issuer != issuer_cert.subject or not crl.is_signature_valid(issuer_cert.public_key()):
+            raise ValueError(f"CRL не подписан {issuer_cert.subject.rfc4514_string()}")
+        usage = _extension(issuer_cert, x509.KeyUsage)
+        if usage is None or not usage.crl_sign:
+            raise ValueError(f"{issuer_cert.subject.rfc4514_string()} не может подписывать CRL")
+
+        number = _extension(crl, x509.CRLNumber)
+        number = number.crl_number if number is not None else 0
+        delta = _extension(crl, x509.DeltaCRLIndicator)
+        current = self._issuers.get(crl.issuer)
+
+        if delta is not None:
+            # delta-CRL применим только к тому полному CRL, от которого он построен
+            if current is None or current["base_number"] != delta.crl_number or number <= current["number"]:
+                return False
+            for revoked in crl:
+                reason = _entry_reason(revoked)
+                if reason == x509.ReasonFlags.remove_from_crl:
+                    current["serials"].discard(revoked.serial_number)
+                else:
+                    current["serials"].add(revoked.serial_number)
+            current["number"], current["next_update"] = number, crl.next_update_utc
+            return True
+
+        if current is not None and number <= current["number"]:
+            return False
+        self._issuers[crl.issuer] = {
+            "number": number,
+            "base_number": number,
+            "next_update": crl.next_update_utc,
+            "serials": {revoked.serial_number for revoked in crl}
+        }
+        return True
+
+    def load_file(self, path, issuer_cert):
+        stat = os.stat(path)
+        if self._files.get(path) == (stat.st_mtime_ns, stat.st_size):
+            return False
+        with open(path, "rb") as f:
+            data = f.read()
+        crl = (x509.load_pem_x509_crl(data) if data.startswith(b"-----BEGIN")
+               else x509.load_der_x509_crl(data))
+        loaded = self.load_crl(crl, issuer_cert)
+        # файл запоминается только после проверки подписи: отвергнутый CRL проверяется снова
+        self._files[path] = (stat.st_mtime_ns, stat.st_size)
+        return loaded
+
+    def check(self, certificate, now=None):
+        """GOOD, REVOKED или UNKNOWN (нет действующего CRL издателя)."""
+        entry = self._issuers.get(certificate.issuer)
+        if entry is None:
+            return UNKNOWN
+        if certificate.serial_number in entry["serials"]:
+            return REVOKED
+        now = now or datetime.datetime.now(datetime.UTC)
+        if entry["next_update"] is not None and entry["next_update"] < now:
+            return UNKNOWN
+        return GOOD
+
+    def check_many(self, certificates, now=None):
+        now = now or datetime.datetime.now(datetime.UTC)
+        return [self.check(certificate, now) for certificate in certificates]
+
+
+def _entry_reason(revoked):
+    for extension in revoked.extensions:
+        if isinstance(extension.value, x509.CRLReason):
+            return extension.value.reason
+    return None
@@ -0,0 +1,208 @@
+"""Benchmarks of the chain operations on synthetic chains.
+
+Every chain is built in a temporary directory, nothing is written into the
+repository. Results are saved as JSON, and a previous result file can be
+passed with --baseline to compare the runs.
+
+    python benchmarks/bench_chain.py --sizes 1000 100000 --ops 500
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "Module1"))
+sys.path.append(os.path.join(ROOT, "Module2"))
+
+import Task1_3  # noqa: E402
+import Task2_1  # noqa: E402
+import Task2_2  # noqa: E402
+from storage import SegmentStorage  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def dir_size(path):
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            total += dir_size(entry.path) if entry.is_dir() else entry.stat().st_size
+    return total
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def measure(func, calls, written_dir=None):
+    """Run func for every argument tuple in calls and collect the statistics."""
+    size_before = dir_size(written_dir) if written_dir else 0
+    latencies = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for args in calls:
+            call_started = time.perf_counter()
+            func(*args)
+            latencies.append(time.perf_counter() - call_started)
+        seconds = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "seconds": seconds,
+        "ops_per_sec": len(latencies) / seconds if seconds else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "bytes_written": dir_size(written_dir) - size_before if written_dir else 0
+    }
+
+
+def build_module1_chain(blocks_dir, size):
+    # the same files as create_genesis_block/create_new_block, without a directory listing per block
+    os.mkdir(blocks_dir)
+    previous_hash = "0"
+    for index in range(size):
+        block = {
+            "index": index,
+            "date": "2024-11-10",
+            "previous_hash": previous_hash,
+            "buyer": f"buyer{index % 1000}",
+            "seller": "Library",
+            "price": index % 500
+        }
+        block["block_hash"] = hashlib.md5(json.dumps(block).encode()).hexdigest()
+        content = json.dumps(block, indent=4).encode()
+        with open(os.path.join(blocks_dir, f"block_{index}.json"), "wb") as f:
+            f.write(content)
+        previous_hash = hashlib.md5(content).hexdigest()
+
+
+def build_module2_chain(blockchain, size):
+    blockchain.generate_genesis_block()
+    for index in range(1, size):
+        blockchain.add_block([{"buyer": f"buyer{index}", "seller": f"seller{index % 100}", "amount": index}])
+    blockchain.flush()
+
+
+def build_merge_chains(main_dir, short_dir, size, overlap):
+    main, short = Task2_2.Blockchain(main_dir), Task2_2.Blockchain(short_dir)
+    previous_hash = "0"
+    for number in range(size + overlap):
+        block = main.create_block(previous_hash, number)
+        block["timestamp"] = str(number)
+        block["block_hash"] = main._calculate_hash(dict(block, block_hash=""))
+        if number < size:
+            main.write_block(block, os.path.join(main_dir, f"block_{number}.json"))
+        if number >= size - overlap:
+            short.write_block(block, os.path.join(short_dir, f"block_{number}.json"))
+        previous_hash = block["block_hash"]
+
+
+def run_size(work_dir, size, ops, storage):
+    rng = random.Random(size)
+    results = {}
+
+    def sample(count):
+        return [rng.randrange(size) for _ in range(count)]
+
+    m1_dir = os.path.join(work_dir, "module1")
+    build_module1_chain(m1_dir, size)
+    opened = {}
+    results["m1_open_with_index"] = measure(
+        lambda: opened.setdefault("chain", Task1_3.Blockchain(m1_dir)), [()])
+    m1 = opened["chain"]
+    results["m1_view_block"] = measure(m1.view_block, [(i,) for i in sample(ops)])
+    results["m1_search_block"] = measure(m1.search_block, [("buyer", f"buyer{i % 1000}") for i in sample(ops)])
+    results["m1_verify_block"] = measure(m1.verify_block, [(min(i, size - 2),) for i in sample(ops)])
+    results["m1_verify_chain"] = measure(m1.verify_chain, [()])
+    results["m1_create_new_block"] = measure(
+        m1.create_new_block, [("2024-11-13", "Alice", "Library", 100)] * ops, m1_dir)
+    m1.close()
+    shutil.rmtree(m1_dir)
+
+    m2_dir = os.path.join(work_dir, "module2")
+    m2_storage = SegmentStorage(m2_dir) if storage == "segments" else None
+    m2 = Task2_1.Blockchain(m2_dir, storage=m2_storage)
+    build_module2_chain(m2, size - ops)
+    results["m2_add_block"] = measure(
+        m2.add_block, [([{"buyer": f"new{i}", "seller": "Bob", "amount": i}],) for i in range(ops)], m2_dir)
+    results["m2_search_transaction"] = measure(
+        m2.search_transaction, [(f"buyer{i}", f"seller{i % 100}") for i in sample(ops)])
+    results["m2_validate_blockchain_full"] = measure(m2.validate_blockchain, [(True,)])
+    results["m2_validate_blockchain_incremental"] = measure(m2.validate_blockchain, [()])
+    m2.close()
+    shutil.rmtree(m2_dir)
+
+    main_dir, short_dir = os.path.join(work_dir, "merge_main"), os.path.join(work_dir, "merge_short")
+    build_merge_chains(main_dir, short_dir, size, overlap=min(ops, size))
+    merger = Task2_2.BlockchainWithMerge(main_dir)
+    results["m2_validate_and_merge_chain"] = measure(merger.validate_and_merge_chain, [(short_dir,)], main_dir)
+    merger.close()
+    shutil.rmtree(main_dir)
+    shutil.rmtree(short_dir)
+    return results
+
+
+def compare(results, baseline):
+    for size, benchmarks in results["sizes"].items():
+        for name, stats in benchmarks.items():
+            old = baseline.get("sizes", {}).get(size, {}).get(name)
+            if old and old["ops_per_sec"]:
+                change = (stats["ops_per_sec"] / old["ops_per_sec"] - 1) * 100
+                print(f"{size:>8} {name:<36} {stats['ops_per_sec']:>12.1f} ops/s  {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the chain operations")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--ops", type=int, default=1000, help="timed operations per benchmark")
+    parser.add_argument("--storage", choices=["files", "segments"], default="segments")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="previous result file to compare with")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "storage": args.storage,
+        "sizes": {}
+    }
+    for size in args.sizes:
+        ops = min(args.ops, max(1, size // 2))
+        with tempfile.TemporaryDirectory(prefix="bench_chain_") as work_dir:
+            started = time.perf_counter()
+            results["sizes"][str(size)] = run_size(work_dir, size, ops, args.storage)
+            print(f"Chain of {size} blocks done in {time.perf_counter() - started:.1f} s")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()